@@ -6,11 +6,10 @@ import matplotlib.ticker as mticker
 import matplotlib.dates as mdates
 import seaborn as sns
 
+import os
 import datetime
-from main import Config
-
-# initialise the global var
-metavar = Config()
+from main import metavar  # frames are built lazily and shared with main
+from common.sweep import load_results
 
 # initialise pyplot settings
 plt.rcParams["axes.unicode_minus"] = False  # display minus sign correctly
@@ -350,8 +349,9 @@ class Microscope:
 if __name__ == '__main__':
     rets_file = "./results/timereturn.csv"
     opt_resulst = "./results/opt_results.csv"
+    opt_sweep = "./results/opt_sweep.csv"  # optimise() 的结果, 回测未完成时也可读取
 
-    opt_df = pd.read_csv(opt_resulst)
+    opt_df = load_results(opt_sweep) if os.path.exists(opt_sweep) else pd.read_csv(opt_resulst)
     rets_df = pd.read_csv(rets_file)
     rets_df = rets_df.rename(columns={'Unnamed: 0': 'Date', '0': 'timereturn'})
     rets_df.set_index('Date', inplace=True)
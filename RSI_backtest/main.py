@@ -7,14 +7,21 @@ import pyfolio as pyf
 import numpy as np
 import pandas as pd
 
+sys.path.append(os.path.abspath(".."))
+from common.bars import load_bars
+from common.feeds import ArrayData
+from common.indcache import cached
+from common.lazy import lazyframe
+from common.lowmem import cerebro_kwargs
+from common.sessions import TradingCalendar
+from common.sweep import calmar_score, date_window, halving, span_years, sweep
+
 
 class Config:
 
     valid_contracts = ["IF00", "IH00", "IC00"]
     contract = valid_contracts[0]
 
-    data = os.path.abspath("../data.csv")
-    df = pd.read_csv(data, index_col='TRADE_DT', parse_dates=True)
     fromdate = datetime.date(2010, 1, 1)
     todate = datetime.date(2021, 12, 31)
 
@@ -23,15 +30,26 @@ class Config:
     is_ctp = False  # 是否平今仓
 
     def __init__(self):
-        # 交易时间表
-        self.shortlen_df = self.create_df(self.df, self.contract, '5Min')
-        self.longlen_df = self.create_df(self.df, self.contract, '15Min')
-        self.time_df = self.create_timedf(self.shortlen_df)
-
         # 保证金比例和合约乘数
         self.margin = self.set_margin(self.contract)
         self.mult = self.set_mult(self.contract)
 
+    # lazyframe 的缓存键: 各帧所依赖的属性
+    memo_attrs = ('contract', 'fromdate', 'todate')
+
+    @lazyframe
+    def shortlen_df(self):
+        return self.create_df(self.contract, '5Min')
+
+    @lazyframe
+    def longlen_df(self):
+        return self.create_df(self.contract, '15Min')
+
+    @lazyframe
+    def calendar(self):
+        # 交易时间表
+        return TradingCalendar(self.shortlen_df.index)
+
     def set_margin(self, contract):
         # 保证金设置
         if contract in ["IH00", "IC00"]:
@@ -50,40 +68,19 @@ class Config:
 
         raise TypeError('Unvalid contract name')
 
-    def create_df(self, raw_df, contract, freq):
+    def create_df(self, contract, freq):
         """
-        Convert the raw .csv file into the target
-        dataframe with specified frequency
+        Return the adjusted bars of the contract with specified
+        frequency, resampled once and then read from the bar cache
+
+        Bars are aligned to the trading sessions and labelled by their
+        end time, none of them crosses the lunch break or the close.
+        The left-labelled bars of df.resample used before were stamped
+        with the start of their bin, so the 15-min bar was seen up to 15
+        minutes before it closed: the signals and results differ from
+        those of the old bars.
         """
-        df = raw_df[raw_df["S_INFO_CODE"] == contract]
-
-        adj_cols = [
-            "S_DQ_ADJOPEN",
-            "S_DQ_ADJHIGH",
-            "S_DQ_ADJLOW",
-            "S_DQ_ADJCLOSE",
-        ]
-        pre_cols = ["S_DQ_OPEN", "S_DQ_HIGH", "S_DQ_LOW", "S_DQ_CLOSE"]
-
-        for pre_col, adj_col in zip(pre_cols, adj_cols):
-            df.loc[:, adj_col] = round(df.loc[:, pre_col] * df.loc[:, "S_DQ_ADJFACTOR"], 1)
-
-        df = df[adj_cols]
-        methods = ["first", "max", "min", "last"]
-        agg_dict = {col: method for col, method in zip(adj_cols, methods)}
-
-        df = df.resample(freq).agg(agg_dict).dropna()
-
-        return df
-
-    def create_timedf(self, df):
-        """Return the time df that contains the trading bars per day"""
-        timedf = pd.DataFrame(index=df.index.date)
-        timedf["time"] = df.index.time
-        timedf = timedf.groupby(timedf.index).apply(lambda x: list(x["time"]))
-        timedf.index = pd.to_datetime(timedf.index)
-
-        return timedf
+        return load_bars(contract, freq, self.fromdate, self.todate, how='session')
 
 metavar = Config()
 
@@ -103,7 +100,7 @@ class Logger:
         pass
 
 
-class MainContract(bt.feeds.PandasData):
+class MainContract(ArrayData):
     params = (
         ("nullvalue", np.nan),
         ("fromdate", metavar.fromdate),
@@ -186,10 +183,10 @@ class EnhancedRSI(bt.Strategy):
         self.dataopen = self.datas[0].open
         self.datadatetime = self.datas[0].datetime
 
-        # 设置指标
-        self.rsi_s = bt.ind.RSI_SMA(self.datas[0], period=self.p.period, safediv=True)
-        self.rsi_l = bt.ind.RSI_SMA(self.datas[1], period=self.p.period, safediv=True)
-        self.atr = bt.ind.ATR(self.datas[0], period=self.p.period)
+        # 设置指标, 参数寻优时只改变阈值的各次回测共用同一指标
+        self.rsi_s = cached(bt.ind.RSI_SMA, self.datas[0], period=self.p.period, safediv=True)
+        self.rsi_l = cached(bt.ind.RSI_SMA, self.datas[1], period=self.p.period, safediv=True)
+        self.atr = cached(bt.ind.ATR, self.datas[0], period=self.p.period)
 
         self.order = None
         self.buyprice = None
@@ -260,14 +257,11 @@ class EnhancedRSI(bt.Strategy):
 
     def next(self):
         # Time management
-        date = bt.num2date(self.datadatetime[0]).date().isoformat()
-        time = bt.num2time(self.datadatetime[0])
-        trade_time = metavar.time_df.loc[date]
-        open_time = trade_time[0]
-        close_time = trade_time[-2]  # 使用收盘时间前一个bar作为平今仓信号
+        dtnum = self.datadatetime[0]
+        time = metavar.calendar.minute(dtnum)
+        open_time, _, close_time = metavar.calendar.lookup(dtnum)  # 使用收盘时间前一个bar作为平今仓信号
 
-        interval = datetime.timedelta(minutes=5) * self.p.period  # 开盘后1小时交易
-        start_time = (datetime.datetime.combine(datetime.date.today(), open_time) + interval).time()
+        start_time = open_time + 5 * self.p.period  # 开盘后1小时交易
 
         # 跳过当前交易的条件
         bypass_conds = [
@@ -369,30 +363,38 @@ def normal_analysis(strats):
     print(perf_df)
 
 
+def opt_metrics(result):
+    """Performance metrics of one run of the optimisation"""
+    analysers = {}
+
+    # 返回参数
+    rets = pd.Series(result.analyzers._TimeReturn.get_analysis())
+    
+    # 夏普比率
+    cumrets = emp.cum_returns(rets, starting_value=0)
+    max_drawdown = emp.max_drawdown(rets)
+    num_years = span_years(rets)
+    ann_rets = (1 + cumrets.iloc[-1]) ** (1 / num_years) - 1
+    calmar = calmar_score(ann_rets, max_drawdown)
+    yearly_trade_times = rets.shape[0] / num_years
+    sharpe = emp.sharpe_ratio(rets, risk_free=0, annualization=yearly_trade_times)  # 4.5h 交易时间
+    
+    analysers['cumrets'] = cumrets.iloc[-1]
+    analysers['ann_rets'] = ann_rets
+    analysers['max_drawdown'] = max_drawdown
+    analysers['calmar_ratio'] = calmar
+    analysers['sharpe'] = sharpe
+
+    return analysers
+
+
 def opt_analysis(results):
 
     def get_analysis(result):
         analysers = {}
         analysers['thold_s'] = result.params.thold_s
         analysers['thold_l'] = result.params.thold_l
-
-        # 返回参数
-        rets = pd.Series(result.analyzers._TimeReturn.get_analysis())
-        
-        # 夏普比率
-        cumrets = emp.cum_returns(rets, starting_value=0)
-        max_drawdown = emp.max_drawdown(rets)
-        num_years = metavar.todate.year - metavar.fromdate.year
-        ann_rets = (1 + cumrets[-1]) ** (1 / num_years) - 1
-        calmar = ann_rets / -max_drawdown
-        yearly_trade_times = rets.shape[0] / num_years
-        sharpe = emp.sharpe_ratio(rets, risk_free=0, annualization=yearly_trade_times)  # 4.5h 交易时间
-        
-        analysers['cumrets'] = cumrets[-1]
-        analysers['ann_rets'] = ann_rets
-        analysers['max_drawdown'] = max_drawdown
-        analysers['calmar_ratio'] = calmar
-        analysers['sharpe'] = sharpe
+        analysers.update(opt_metrics(result))
 
         return analysers
 
@@ -403,21 +405,29 @@ def opt_analysis(results):
     print(opt_df)
 
 
-def run():
-    # 保存回测交易单到本地
-    sys.stdout = Logger()
+def build_cerebro(lowmem=False, frames=None, **params):
+    """
+    Set up the backtest
+
+    lowmem=True bounds the line buffers of the sub-indicators
+    (exactbars=-1 for the 5-min and 15-min datas, see common/lowmem.py),
+    `check_lowmem(build_cerebro)` verifies that it trades exactly like
+    the full run. frames holds the "short" and "long" bars, default those
+    of metavar, params are passed to the strategy.
+    """
+    frames = frames or {"short": metavar.shortlen_df, "long": metavar.longlen_df}
 
     # Initiate the strategy
-    cerebro = bt.Cerebro()
-    cerebro.addstrategy(EnhancedRSI)
+    cerebro = bt.Cerebro(**cerebro_kwargs(lowmem, datas=2))
+    cerebro.addstrategy(EnhancedRSI, **params)
 
-    # Optimisation
+    # Optimisation, see optimise()
     # cerebro = bt.Cerebro(optdatas=True, optreturn=True)
     # cerebro.optstrategy(EnhancedRSI, thold_l=range(35, 60, 5), thold_s=range(60, 85, 5))
 
     # Load datas
-    data0 = MainContract(dataname=metavar.shortlen_df)
-    data1 = MainContract(dataname=metavar.longlen_df)
+    data0 = MainContract(dataname=frames["short"])
+    data1 = MainContract(dataname=frames["long"])
 
     # Add data feeds
     cerebro.adddata(data0, name="short")
@@ -444,6 +454,15 @@ def run():
     comminfo = FurCommInfo()
     cerebro.broker.addcommissioninfo(comminfo)
 
+    return cerebro
+
+
+def run(lowmem=False):
+    # 保存回测交易单到本地
+    sys.stdout = Logger()
+
+    cerebro = build_cerebro(lowmem)
+
     init_msg = f"""
             策略: 改良长短RSI
             回测对象: {metavar.contract}
@@ -467,5 +486,40 @@ def run():
     # opt_analysis(results)
 
 
+def optimise(processes=None):
+    """Run the threshold optimisation in parallel, see common/sweep.py"""
+    frames = {"short": metavar.shortlen_df, "long": metavar.longlen_df}
+    grid = dict(thold_l=range(35, 60, 5), thold_s=range(60, 85, 5))
+
+    # 可中断后重新运行, 已完成的参数组合不再回测
+    opt_df = sweep(build_cerebro, grid, opt_metrics, frames, './results/opt_sweep.csv', processes)
+    print(opt_df)
+
+    return opt_df
+
+
+def search(processes=None):
+    """
+    Search the parameters with the best calmar ratio by successive
+    halving over growing date ranges instead of the full grid,
+    see common/sweep.py
+    """
+    frames = date_window({"short": metavar.shortlen_df, "long": metavar.longlen_df}, metavar.fromdate, metavar.todate)
+    grid = dict(
+        thold_l=range(35, 60, 5),
+        thold_s=range(60, 85, 5),
+        period=(9, 11, 14),
+        stop_limit=(0.01, 0.02, 0.03),
+        target_percent=(0.10, 0.15, 0.20),
+    )
+
+    opt_df = halving(build_cerebro, grid, opt_metrics, frames, './results/opt_search.csv', processes=processes)
+    print(opt_df)
+
+    return opt_df
+
+
 if __name__ == "__main__":
     run()
+    # optimise()
+    # search()
@@ -6,10 +6,7 @@ import matplotlib.ticker as mticker
 import seaborn as sns
 
 import datetime
-from main import Config
-
-# initialise the global var
-metavar = Config()
+from main import metavar  # frames are built lazily and shared with main
 
 # initialise pyplot settings
 plt.rcParams["axes.unicode_minus"] = False  # display minus sign correctly
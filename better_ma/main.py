@@ -8,6 +8,13 @@ import empyrical as emp
 import datetime
 import os, sys
 
+sys.path.append(os.path.abspath(".."))
+from common.bars import load_bars
+from common.feeds import ArrayData
+from common.lazy import lazyframe
+from common.lowmem import cerebro_kwargs
+from common.sweep import calmar_score, date_window, halving, span_years
+
 
 class Config:
     """For global variable"""
@@ -23,11 +30,6 @@ class Config:
         self.contract = 'IF00'
         self.freq = '10min'
 
-        # 数据处理
-        filepath = os.path.join(os.path.abspath('..'),'data.csv')
-        raw_df = pd.read_csv(filepath, index_col='TRADE_DT')
-        self.df = self.create_df(raw_df, self.contract, self.freq)
-
         # 交易参数
         self.mult = self.set_mult()
         self.margin = self.set_margin()
@@ -38,28 +40,21 @@ class Config:
         # 平今仓
         self.closeout_type = 1
 
+    # lazyframe 的缓存键: 各帧所依赖的属性
+    memo_attrs = ('contract', 'freq')
+
+    @lazyframe
+    def df(self):
+        # 数据处理
+        return self.create_df(self.contract, self.freq)
 
-    def create_df(self, raw_df, contract, freq):
+    def create_df(self, contract, freq):
         """
-        Convert the raw .csv file into the target
-        dataframe with specified frequency
+        Return the adjusted bars of the contract with specified
+        frequency, resampled once and then read from the bar cache
         """
-        df = raw_df[raw_df['S_INFO_CODE'] == contract]
-
-        # convert index to datetime object
-        df.index = pd.to_datetime(df.index)
-
-        # resampling
-        df = df.resample(rule=freq, origin='end').last().dropna()
-
-        # calculate adj prices
-        adj_cols = ["S_DQ_ADJOPEN", "S_DQ_ADJHIGH", "S_DQ_ADJLOW", "S_DQ_ADJCLOSE",]
-        pre_cols = ["S_DQ_OPEN", "S_DQ_HIGH", "S_DQ_LOW", "S_DQ_CLOSE"]
-
-        for pre_col, adj_col in zip(pre_cols, adj_cols):
-            df[adj_col] = round(df[pre_col] * df['S_DQ_ADJFACTOR'], 1)
-
-        return df[adj_cols]
+        # 整段数据重采样, origin='end'依赖最后一个bar
+        return load_bars(contract, freq, how='last', origin='end')
 
     def set_margin(self):
         # 保证金设置
@@ -102,7 +97,7 @@ class Logger:
         pass
 
 
-class MainContract(bt.feeds.PandasData):
+class MainContract(ArrayData):
     params = (
         ("nullvalue", np.nan),
         ("fromdate", metavar._fromdate),
@@ -257,36 +252,43 @@ class BetterMA(bt.Strategy):
         if not self.position:
             # 同传统均线策略开仓逻辑
             if self.crossover == 1.0:  # 金叉
-                self.order_target_percent(target=self.p.target_percent)
+                self.order = self.order_target_percent(target=self.p.target_percent)
 
             elif self.crossover == -1.0:  # 死叉
-                self.order_target_percent(target=-self.p.target_percent)
+                self.order = self.order_target_percent(target=-self.p.target_percent)
         else:
             # 改良平仓逻辑
             if self.position.size > 0:
                 # if (self.dataclose[0] / self.buy_create - 1) < self.p.closeout_limit:
                 if self.dataclose[0] < self.buy_create:
-                    self.order_target_percent(target=0)
+                    self.order = self.order_target_percent(target=0)
                     self.order.addinfo(name='CLOSE OUT BECAUSE OF STOP LIMIT')
 
             else:
                 # if (self.dataclose[0] / self.sell_create - 1) > self.p.closeout_limit:
                 if self.dataclose[0] > self.sell_create:
-                    self.order_target_percent(target=0)
+                    self.order = self.order_target_percent(target=0)
                     self.order.addinfo(name='CLOSE OUT BECAUSE OF STOP LIMIT')
 
     def stop(self):
         pass
     
 
-if __name__ == "__main__":
-    sys.stdout = Logger()
+def build_cerebro(lowmem=False, frames=None, **params):
+    """
+    Set up the backtest
 
-    data = MainContract(dataname=metavar.df)
+    lowmem=True bounds every line buffer to the moving average periods
+    (exactbars=1, see common/lowmem.py), `check_lowmem(build_cerebro)`
+    verifies that it trades exactly like the full run. frames holds the
+    "bars", default metavar.df, params are passed to the strategy.
+    """
+    frames = frames or {"bars": metavar.df}
+    data = MainContract(dataname=frames["bars"])
 
-    cerebro = bt.Cerebro()
+    cerebro = bt.Cerebro(**cerebro_kwargs(lowmem))
     cerebro.adddata(data)
-    cerebro.addstrategy(BetterMA)
+    cerebro.addstrategy(BetterMA, **params)
 
     comminfo = FurCommInfo()
     cerebro.broker.addcommissioninfo(comminfo)
@@ -300,6 +302,14 @@ if __name__ == "__main__":
     cerebro.addanalyzer(bt.analyzers.Returns, _name="_Return", timeframe=bt.TimeFrame.Minutes)
     cerebro.addanalyzer(bt.analyzers.Calmar, _name="_CalmarRatio")
 
+    return cerebro
+
+
+def run(lowmem=False):
+    sys.stdout = Logger()
+
+    cerebro = build_cerebro(lowmem)
+
     # backtesting
     init_msg = f"""
             回测对象: {metavar.contract}
@@ -361,3 +371,48 @@ if __name__ == "__main__":
     results_df = pd.Series(results_dict)
     print(results_df)
 
+
+def opt_metrics(result):
+    """Performance metrics of one run of the optimisation"""
+    rets = pd.Series(result.analyzers._TimeReturn.get_analysis())
+    cumrets = emp.cum_returns(rets, starting_value=0)
+    max_drawdown = emp.max_drawdown(rets)
+
+    num_years = span_years(rets)
+    ann_rets = (1 + cumrets.iloc[-1]) ** (1 / num_years) - 1
+    yearly_trade_times = rets.shape[0] / num_years
+    sharpe = emp.sharpe_ratio(rets, risk_free=0, annualization=yearly_trade_times)
+
+    return dict(
+        cumrets=cumrets.iloc[-1],
+        ann_rets=ann_rets,
+        max_drawdown=max_drawdown,
+        calmar_ratio=calmar_score(ann_rets, max_drawdown),
+        sharpe=sharpe,
+    )
+
+
+def search(processes=None):
+    """
+    Search the parameters with the best calmar ratio by successive
+    halving over growing date ranges, see common/sweep.py
+    """
+    grid = dict(
+        fast_sma=(20, 40, 60, 80),
+        slow_sma=(120, 180, 240),
+        closeout_limit=(0.01, 0.02, 0.03),
+        target_percent=(0.2, 0.3),
+    )
+
+    # 只在回测区间内取前缀
+    frames = date_window({"bars": metavar.df}, metavar._fromdate, metavar._todate)
+
+    opt_df = halving(build_cerebro, grid, opt_metrics, frames, "./opt_search.csv", processes=processes)
+    print(opt_df)
+
+    return opt_df
+
+
+if __name__ == "__main__":
+    run()
+    # search()
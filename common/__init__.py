@@ -0,0 +1,2 @@
+# -*- coding: UTF-8 -*-
+# Shared data utilities for the strategies in this repository
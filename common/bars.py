@@ -0,0 +1,104 @@
+# -*- coding: UTF-8 -*-
+# Cache of resampled OHLC bars built from the columnar store
+#
+# Each (contract, frequency, resample options) is resampled once over the
+# whole history and saved as store/bars/<contract>/<label>.<sha1>.parquet,
+# where sha1 identifies the data.csv the bars were built from. Backtests and
+# parameter sweeps then read the cached bars instead of resampling minutes.
+
+import pandas as pd
+
+import os
+import glob
+import hashlib
+
+from common import datastore
+from common.prices import adjust_prices, ADJ_COLS
+from common.sessions import resample_session
+
+CACHE_PATH = os.path.join(datastore.STORE_PATH, "bars")
+
+METHODS = ["first", "max", "min", "last"]
+
+
+def resample_ohlc(df, freq, how="ohlc", **kwargs):
+    """
+    Resample adjusted minute prices to the target frequency
+
+    Params
+    ------
+    - df:
+        adjusted prices with ADJ_COLS columns
+    - freq:
+        pandas offset alias, e.g. '5Min', 'D', 'W-MON'
+    - how:
+        'ohlc' aggregates first/max/min/last, 'last' keeps the last
+        minute bar of each bin for all four columns, 'session' aggregates
+        intraday bins aligned to the trading sessions, see `resample_session`
+    - kwargs:
+        extra arguments of `df.resample`, e.g. origin='end'
+    """
+    if how == "session":
+        minutes = pd.Timedelta(freq) // pd.Timedelta(minutes=1)
+        return resample_session(df, minutes)
+
+    resampler = df.resample(freq, **kwargs)
+    if how == "ohlc":
+        df = resampler.agg(dict(zip(ADJ_COLS, METHODS)))
+    elif how == "last":
+        df = resampler.last()
+    else:
+        raise ValueError(f"Invalid resample method {how}")
+
+    return df.dropna()
+
+
+def bar_label(freq, how, kwargs):
+    """Return the file name prefix describing the resample options"""
+    opts = "".join(f"_{k}={v}" for k, v in sorted(kwargs.items()))
+    return f"{freq}_{how}{opts}"
+
+
+def load_bars(contract, freq, fromdate=None, todate=None, how="ohlc", **kwargs):
+    """
+    Return the adjusted OHLC bars of a contract, resampled
+    from the minute data on the first call and cached on disk
+
+    Params
+    ------
+    - contract:
+        name of the main contract
+    - freq, how, kwargs:
+        resample options, see `resample_ohlc`
+    - fromdate, todate:
+        datetime.date range of the returned bars, default all bars
+
+    Returns
+    -------
+    - df: pd.DataFrame
+        bars with ADJ_COLS columns
+    """
+    label = bar_label(freq, how, kwargs)
+    srchash = datastore.source_hash()
+    key = hashlib.sha1(f"{label}|{srchash}".encode()).hexdigest()[:12]
+
+    folder = os.path.join(CACHE_PATH, contract)
+    path = os.path.join(folder, f"{label}.{key}.parquet")
+
+    if os.path.exists(path):
+        df = pd.read_parquet(path)
+    else:
+        df = resample_ohlc(adjust_prices(datastore.load(contract)), freq, how, **kwargs)
+
+        # 删除基于旧数据的缓存
+        os.makedirs(folder, exist_ok=True)
+        for stale in glob.glob(os.path.join(folder, glob.escape(label) + ".*.parquet")):
+            os.remove(stale)
+        df.to_parquet(path)
+
+    if fromdate or todate:
+        start = fromdate.isoformat() if fromdate else None
+        end = todate.isoformat() if todate else None
+        df = df.loc[start:end]
+
+    return df
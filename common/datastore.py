@@ -0,0 +1,174 @@
+# -*- coding: UTF-8 -*-
+# Columnar store for the multi-contract minute data in ../data.csv
+#
+# data.csv is parsed once and written as one parquet file per contract
+# and per year, e.g. store/IF00/2015.parquet. Every strategy then reads
+# only the partitions covering its own contract and backtest window.
+
+import pandas as pd
+
+import os
+import json
+import hashlib
+import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_PATH = os.path.join(ROOT, "data.csv")
+STORE_PATH = os.path.join(ROOT, "store")
+
+INDEX_COL = "TRADE_DT"
+CODE_COL = "S_INFO_CODE"
+
+# 字段类型, 未列出的字段沿用pandas推断的类型
+SCHEMA = {
+    "S_INFO_CODE": "category",
+    "S_DQ_OPEN": "float64",
+    "S_DQ_HIGH": "float64",
+    "S_DQ_LOW": "float64",
+    "S_DQ_CLOSE": "float64",
+    "S_DQ_ADJFACTOR": "float64",
+    "S_DQ_VOLUME": "float64",
+    "S_DQ_AMOUNT": "float64",
+    "S_DQ_OI": "float64",
+}
+
+
+def file_hash(path, blocksize=1 << 20):
+    """Return the sha1 hex digest of a file, read in blocks"""
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+
+def read_manifest(dest=STORE_PATH):
+    """Return the manifest of the store, None if the store is not built"""
+    path = os.path.join(dest, "manifest.json")
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def is_fresh(src=DATA_PATH, dest=STORE_PATH):
+    """
+    Check whether the store was built from the current source file,
+    a built store is trusted as is once the source file is removed
+    """
+    manifest = read_manifest(dest)
+    if manifest is None:
+        return False
+
+    # 源文件已删除时沿用已建好的数据库
+    if not os.path.exists(src):
+        return True
+
+    stat = os.stat(src)
+    return manifest["size"] == stat.st_size and manifest["mtime"] == stat.st_mtime
+
+
+def build_store(src=DATA_PATH, dest=STORE_PATH):
+    """
+    Convert the raw .csv file into parquet partitions
+    of contract and year with the typed schema
+
+    Params
+    ------
+    - src:
+        path of the raw minute .csv file
+    - dest:
+        directory of the columnar store
+
+    Returns
+    -------
+    - manifest: dict
+        source file info and the partitions written
+    """
+    columns = pd.read_csv(src, nrows=0).columns
+    dtype = {col: SCHEMA[col] for col in columns if col in SCHEMA}
+    df = pd.read_csv(src, index_col=INDEX_COL, parse_dates=True, dtype=dtype)
+    df = df.sort_index(kind="stable")
+
+    partitions = {}
+    for (contract, year), part in df.groupby([df[CODE_COL], df.index.year], observed=True):
+        folder = os.path.join(dest, str(contract))
+        os.makedirs(folder, exist_ok=True)
+        part.to_parquet(os.path.join(folder, f"{year}.parquet"))
+        partitions.setdefault(str(contract), []).append(int(year))
+
+    stat = os.stat(src)
+    manifest = {
+        "source": os.path.abspath(src),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha1": file_hash(src),
+        "schema": {col: str(df[col].dtype) for col in df.columns},
+        "partitions": partitions,
+    }
+    with open(os.path.join(dest, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+
+def source_hash(src=DATA_PATH, dest=STORE_PATH):
+    """Return the sha1 of the source file the store is built from"""
+    if not is_fresh(src, dest):
+        build_store(src, dest)
+
+    return read_manifest(dest)["sha1"]
+
+
+def load(contract, fromdate=None, todate=None, columns=None, src=DATA_PATH, dest=STORE_PATH):
+    """
+    Load the minute data of one contract within the date range,
+    the store is (re)built first if data.csv has changed
+
+    Params
+    ------
+    - contract:
+        name of the main contract, e.g. "IF00"
+    - fromdate:
+        datetime.date of the first day to load, default the first day in the store
+    - todate:
+        datetime.date of the last day to load, default the last day in the store
+    - columns:
+        list of columns to read, default all columns
+
+    Returns
+    -------
+    - df: pd.DataFrame
+        minute data indexed by TRADE_DT
+    """
+    if not is_fresh(src, dest):
+        build_store(src, dest)
+
+    years = read_manifest(dest)["partitions"].get(contract)
+    if years is None:
+        raise ValueError(f"Invalid contract name {contract}")
+
+    first = fromdate.year if fromdate else years[0]
+    last = todate.year if todate else years[-1]
+    paths = [os.path.join(dest, contract, f"{y}.parquet") for y in years if first <= y <= last]
+    if not paths:
+        raise ValueError(f"No data for {contract} between {fromdate} and {todate}")
+
+    df = pd.concat([pd.read_parquet(path, columns=columns) for path in paths])
+
+    if fromdate or todate:
+        start = fromdate.isoformat() if fromdate else None
+        end = todate.isoformat() if todate else None
+        df = df.loc[start:end]
+
+    return df
+
+
+if __name__ == "__main__":
+    start = datetime.datetime.now()
+    manifest = build_store()
+    print(f"Store built in {datetime.datetime.now() - start}")
+    for contract, years in manifest["partitions"].items():
+        print(f"{contract}: {years[0]} - {years[-1]}")
@@ -0,0 +1,39 @@
+# -*- coding: UTF-8 -*-
+# Daily features joined onto intraday bars
+
+import pandas as pd
+
+
+def broadcast_daily(intraday, daily, name=None):
+    """
+    Broadcast daily features onto intraday bars
+
+    Every bar takes the value of its own date, matched on the
+    normalized timestamps in one join. Dates missing from the
+    daily features are left as nan.
+
+    Params
+    ------
+    - intraday: pd.DataFrame
+        bars indexed by timestamp
+    - daily: pd.Series or pd.DataFrame
+        features indexed by date
+    - name:
+        column name of a Series feature, default the Series name
+
+    Returns
+    -------
+    - out: pd.DataFrame
+        copy of `intraday` with the feature columns appended
+    """
+    if isinstance(daily, pd.Series):
+        daily = daily.to_frame(name or daily.name)
+
+    daily = daily.set_axis(pd.DatetimeIndex(daily.index).normalize())
+    values = daily.reindex(intraday.index.normalize())
+
+    out = intraday.copy()
+    for col in values.columns:
+        out[col] = values[col].to_numpy()
+
+    return out
@@ -0,0 +1,184 @@
+# -*- coding: UTF-8 -*-
+# Data feeds backed by NumPy arrays
+#
+# bt.feeds.PandasData reads every field of every bar with `df.iloc`. ArrayData
+# takes the same params, but converts the columns and the datetime index to
+# contiguous float64 arrays once in start() and preloads the lines from them
+# in bulk, which keeps the preload/runonce fast path of cerebro cheap on
+# 1-minute data.
+
+import pandas as pd
+import numpy as np
+import backtrader as bt
+
+import datetime
+
+from backtrader.linebuffer import LineBuffer
+
+# datetime64[D] counts days from 1970-01-01
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def date2num(index):
+    """
+    Vectorized `bt.date2num` of a DatetimeIndex
+
+    Tz-aware timestamps are converted to naive UTC like `bt.date2num` does.
+    For timestamps on whole minutes the result is bit-identical to
+    `bt.date2num`, whose fsum of the ordinal, hour and minute terms equals
+    the ordinal plus the rounded sum of the fractions.
+
+    Params
+    ------
+    - index:
+        pd.DatetimeIndex or array-like of timestamps
+
+    Returns
+    -------
+    - dtnum: np.ndarray
+        float64 array of backtrader date numbers
+    """
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_convert(None)
+
+    stamps = index.values.astype("datetime64[us]")
+    days = stamps.astype("datetime64[D]")
+    micros = (stamps - days).astype(np.int64)
+
+    hour, micros = np.divmod(micros, 3600 * 10**6)
+    minute, micros = np.divmod(micros, 60 * 10**6)
+    second, micros = np.divmod(micros, 10**6)
+
+    frac = hour / 24.0 + minute / 1440.0
+    frac = frac + second / 86400.0 + micros / 86400e6
+
+    return (days.astype(np.int64) + EPOCH_ORDINAL).astype(np.float64) + frac
+
+
+class ArrayData(bt.feeds.PandasData):
+    """
+    Drop-in replacement of bt.feeds.PandasData backed by NumPy arrays
+
+    The column mapping params work as in PandasData, including extra
+    lines of subclasses. With preload (the default) every line is filled
+    in a single copy from its array, after the fromdate/todate range is
+    applied. Feeds with filters or an input timezone fall back to the
+    bar by bar path, which reads the arrays instead of `df.iloc`.
+    """
+
+    def start(self):
+        super().start()
+
+        df = self.p.dataname
+        coldtime = self._colmapping["datetime"]
+        stamps = df.index if coldtime is None else df.iloc[:, coldtime]
+
+        self._arrays = {"datetime": date2num(stamps)}
+        for datafield in self.getlinealiases():
+            colindex = self._colmapping[datafield]
+            if datafield == "datetime" or colindex is None:
+                continue
+
+            self._arrays[datafield] = np.ascontiguousarray(df.iloc[:, colindex].to_numpy(dtype=np.float64))
+
+        self._fields = [(getattr(self.lines, name), values) for name, values in self._arrays.items()]
+
+    def _load(self):
+        self._idx += 1
+
+        if self._idx >= len(self._arrays["datetime"]):
+            # exhausted all rows
+            return False
+
+        for line, values in self._fields:
+            line[0] = values[self._idx]
+
+        return True
+
+    def preload(self):
+        bounded = any(line.mode == LineBuffer.QBuffer for line in self.lines)
+        if self._filters or self._ffilters or self._tzinput or bounded:
+            return super().preload()
+
+        # 与 DataBase.load 一致: 跳过 fromdate 之前的bar, 在首个晚于 todate 的bar处停止
+        first = self._idx + 1
+        dtnum = self._arrays["datetime"][first:]
+        keep = dtnum >= self.fromdate
+        after = np.flatnonzero(dtnum > self.todate)
+        if len(after):
+            keep[after[0]:] = False
+        rows = np.flatnonzero(keep) + first
+
+        for datafield in self.getlinealiases():
+            values = self._arrays.get(datafield)
+            values = np.full(len(rows), np.nan) if values is None else values[rows]
+            getattr(self.lines, datafield).array.frombytes(values.tobytes())
+
+        self._idx = len(self._arrays["datetime"])
+
+        self._last()
+        self.home()
+
+
+def write_memmap(df, path, fields):
+    """
+    Write bars once into a structured binary .npy file read by MemmapData
+
+    Params
+    ------
+    - df: pd.DataFrame
+        bars indexed by timestamp
+    - path:
+        path of the .npy file
+    - fields: dict
+        line name -> column name or position in df, e.g. {"close": 3}
+
+    Returns
+    -------
+    - path
+    """
+    dtype = [("datetime", "f8")] + [(name, "f8") for name in fields]
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(len(df),))
+
+    out["datetime"] = date2num(df.index)
+    for name, col in fields.items():
+        values = df.iloc[:, col] if isinstance(col, int) else df[col]
+        out[name] = values.to_numpy(dtype=np.float64)
+
+    out.flush()
+    del out
+
+    return path
+
+
+class MemmapData(ArrayData):
+    """
+    Data feed reading the bars from a memory-mapped file of `write_memmap`
+
+    `dataname` is the path of the .npy file. Every line is read from the
+    field of the same name, lines without a field stay nan, so the column
+    params of PandasData are not used. Pages are only touched when bars
+    are loaded: with preload=False and exactbars the resident memory stays
+    at the active window of the lines.
+    """
+
+    def __init__(self):
+        # skip the DataFrame column mapping of PandasData
+        super(bt.feeds.PandasData, self).__init__()
+
+    def start(self):
+        super(bt.feeds.PandasData, self).start()
+
+        self._idx = -1
+        self._mmap = np.load(self.p.dataname, mmap_mode="r")
+
+        names = self._mmap.dtype.names
+        self._arrays = {name: self._mmap[name] for name in self.getlinealiases() if name in names}
+        self._fields = [(getattr(self.lines, name), values) for name, values in self._arrays.items()]
+
+    def stop(self):
+        super().stop()
+
+        # release the mapping
+        self._arrays = self._fields = self._mmap = None
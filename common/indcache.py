@@ -0,0 +1,127 @@
+# -*- coding: UTF-8 -*-
+# Indicators shared by the runs of a parameter sweep
+#
+# A sweep over signal thresholds (e.g. thold_l x thold_s) recomputes the
+# same RSI_SMA and ATR lines in every run. `cached` computes an indicator
+# once per (data, indicator class, params) and process, later strategies on
+# the same preloaded data get a copy of the stored lines instead. The
+# workers of `common.sweep` keep their cache across the combinations they
+# run, and so does cerebro.optstrategy with optdatas.
+
+import array
+import collections
+
+import backtrader as bt
+
+# 最多保存的指标数, 超出时删除最久未使用的
+MAXSIZE = 32
+
+_cache = collections.OrderedDict()
+_stats = dict(hits=0, misses=0)
+
+# indicator class -> Precomputed subclass with the same lines
+_classes = {}
+
+
+def clear():
+    """Drop every cached indicator"""
+    _cache.clear()
+    _stats.update(hits=0, misses=0)
+
+
+def info():
+    """Return the number of cache hits, misses and cached indicators"""
+    return dict(_stats, size=len(_cache))
+
+
+def data_key(data):
+    """Return the key of a data feed, None for lines and other objects"""
+    dataname = getattr(getattr(data, "p", None), "dataname", None)
+    if dataname is None:
+        return None
+
+    return id(dataname), data.fromdate, data.todate, data.buflen()
+
+
+class Precomputed(bt.Indicator):
+    """Indicator replaying the lines stored by `cached`"""
+
+    params = (
+        ("values", None),  # array.array of each line
+        ("minperiod", 1),
+    )
+
+    def __init__(self):
+        for line in self.lines:
+            line.updateminperiod(self.p.minperiod)
+
+    def _once(self):
+        # 直接复制保存的lines, 不再计算
+        for line, values in zip(self.lines, self.p.values):
+            line.array.extend(values)
+            line.lencount += len(values)
+            line.idx += len(values)
+
+    def next(self):
+        # 其他指标强制逐bar运行时
+        for line, values in zip(self.lines, self.p.values):
+            line[0] = values[len(self) - 1]
+
+
+def _precomputed(cls):
+    if cls not in _classes:
+        _classes[cls] = type(cls.__name__, (Precomputed,), dict(lines=cls.lines._getlines()))
+
+    return _classes[cls]
+
+
+def cached(cls, data, **params):
+    """
+    Create an indicator, or replay its lines if the same indicator
+    was computed on the same data before
+
+    Only preloaded feeds in runonce mode, the cerebro defaults, are
+    cached; otherwise, and for indicators of lines, the indicator is
+    created as usual. Must be called in the __init__ of a strategy.
+
+    Params
+    ------
+    - cls:
+        indicator class, e.g. bt.ind.RSI_SMA
+    - data:
+        data feed of the indicator
+    - params:
+        params of the indicator
+
+    Returns
+    -------
+    - indicator with the lines of cls
+    """
+    dkey = data_key(data)
+    env = data._env
+    if dkey is None or not (env._dopreload and env._dorunonce):
+        return cls(data, **params)
+
+    pairs = tuple((name, params.get(name, default)) for name, default in cls.params._getpairs().items())
+    key = (dkey, cls, pairs)
+
+    if key in _cache:
+        _cache.move_to_end(key)
+        _stats["hits"] += 1
+        values, minperiod, _ = _cache[key]
+        return _precomputed(cls)(data, values=values, minperiod=minperiod)
+
+    _stats["misses"] += 1
+    ind = cls(data, **params)
+    run = ind._once
+
+    def _once():
+        run()
+        # 保留 dataname 的引用, 避免其 id 被其他数据复用
+        _cache[key] = ([array.array("d", line.array) for line in ind.lines], ind._minperiod, data.p.dataname)
+        while len(_cache) > MAXSIZE:
+            _cache.popitem(last=False)
+
+    ind._once = _once
+
+    return ind
@@ -0,0 +1,64 @@
+# -*- coding: UTF-8 -*-
+# Lazily evaluated frames for the strategy Config classes
+
+# Frames built by any Config instance, shared by every instance
+# of the same class whose `memo_attrs` have the same values
+_memo = {}
+
+
+def memo_key(config):
+    """
+    Return the values of the attributes listed in `memo_attrs` of the
+    Config class, which the frames built by the Config depend on
+    """
+    values = []
+    for attr in type(config).memo_attrs:
+        value = getattr(config, attr, None)
+        values.append(tuple(value) if isinstance(value, list) else value)
+
+    return tuple(values)
+
+
+def clear():
+    """Drop every memoized frame"""
+    _memo.clear()
+
+
+class lazyframe:
+    """
+    Decorator turning a Config method into an attribute which is
+    computed on first access and memoized afterwards
+
+    Importing a strategy module and creating its `metavar = Config()`
+    therefore costs nothing, the csv files are only read and resampled
+    once the frame is actually used. The Config class lists the attributes
+    its frames depend on in `memo_attrs`, e.g. the contract and the
+    backtest period; a second Config() with the same values (e.g. in
+    analysis.py) reuses the built frames. Without `memo_attrs` the frames
+    are only memoized per instance.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        if not hasattr(type(instance), "memo_attrs"):
+            value = instance.__dict__[self.name] = self.func(instance)
+            return value
+
+        key = (type(instance), self.name, memo_key(instance))
+        if key not in _memo:
+            _memo[key] = self.func(instance)
+
+        # later lookups hit the instance dict directly
+        value = instance.__dict__[self.name] = _memo[key]
+
+        return value
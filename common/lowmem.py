@@ -0,0 +1,110 @@
+# -*- coding: UTF-8 -*-
+# Bounded-memory backtests
+#
+# A low-memory run sets cerebro's exactbars=1: the lines of the datas,
+# indicators and observers become ring buffers sized by the indicator
+# periods (e.g. slow_sma=120 or the Donchian 55) instead of the whole
+# history, and the datas are loaded bar by bar instead of preloaded.
+# Strategies reading older bars directly in next() (e.g. high[-1] or
+# data.get(size=n)) declare it with `Lookback.lookback()`.
+#
+# Strategies on several datas, e.g. 5-min and 15-min bars, run with
+# exactbars=-1 instead. Loading bar by bar, cerebro rewinds the datas
+# whose next bar is later than the others, and the index of a full ring
+# buffer does not move back: the strategy would see the next 15-min bar.
+# exactbars=-1 keeps the datas and the indicators of the strategy
+# preloaded and only bounds the lines of their sub-indicators.
+#
+# The datas can not be read in stop() of a low-memory run: once the
+# feed is exhausted, backtrader rolls back the last forward of the ring
+# buffers without moving their index back. The lines of the strategy
+# itself, e.g. its datetime, stay readable.
+
+import backtrader as bt
+
+LOWMEM = dict(exactbars=1)
+
+# 多个数据时只限制子指标的缓存
+LOWMEM_MULTIDATA = dict(exactbars=-1)
+
+
+def cerebro_kwargs(lowmem=False, datas=1):
+    """
+    Return the bt.Cerebro kwargs of a normal or a low-memory run
+
+    Params
+    ------
+    - lowmem:
+        bound the line buffers
+    - datas:
+        number of data feeds of the strategy
+    """
+    if not lowmem:
+        return {}
+
+    return dict(LOWMEM) if datas == 1 else dict(LOWMEM_MULTIDATA)
+
+
+class Lookback:
+    """
+    Strategy mixin keeping at least `lookback()` bars of every data
+    and of the lines of the strategy in the bounded line buffers of a
+    low-memory run
+
+    Usage: class MyStrategy(Lookback, bt.Strategy)
+    """
+
+    def lookback(self):
+        """Number of bars next() reads from the datas, 1 means only [0]"""
+        return 1
+
+    def qbuffer(self, savemem=0, replaying=False):
+        super().qbuffer(savemem=savemem, replaying=replaying)
+
+        if savemem > 0:
+            size = self.lookback()
+            for data in self.datas:
+                data.minbuffer(size)
+            for line in self.lines:
+                line.minbuffer(size)
+
+
+def transactions(strat, name):
+    """Return the transactions recorded by the analyzer as a plain dict"""
+    return {dt: [list(t) for t in trans] for dt, trans in strat.analyzers.getbyname(name).get_analysis().items()}
+
+
+def check_lowmem(build, name="_lowmem_check"):
+    """
+    Run the same backtest with full and with bounded line buffers
+    and check that both produce identical transactions
+
+    Params
+    ------
+    - build:
+        function build(lowmem) returning a ready to run bt.Cerebro
+    - name:
+        name of the Transactions analyzer added to both runs
+
+    Returns
+    -------
+    - trans: dict
+        the transactions of the runs
+
+    Raises
+    ------
+    - AssertionError if the transactions differ
+    """
+    results = []
+    for lowmem in (False, True):
+        cerebro = build(lowmem)
+        cerebro.addanalyzer(bt.analyzers.Transactions, _name=name)
+        strat = cerebro.run()[0]
+        results.append(transactions(strat, name))
+
+    full, bounded = results
+    if full != bounded:
+        diff = sorted(dt for dt in set(full) | set(bounded) if full.get(dt) != bounded.get(dt))
+        raise AssertionError(f"Low-memory run differs from the full run at {len(diff)} bars, first at {diff[0]}")
+
+    return full
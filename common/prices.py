@@ -0,0 +1,44 @@
+# -*- coding: UTF-8 -*-
+# Adjusted OHLC prices shared by all strategies
+
+import pandas as pd
+import numpy as np
+
+PRE_COLS = ["S_DQ_OPEN", "S_DQ_HIGH", "S_DQ_LOW", "S_DQ_CLOSE"]
+ADJ_COLS = ["S_DQ_ADJOPEN", "S_DQ_ADJHIGH", "S_DQ_ADJLOW", "S_DQ_ADJCLOSE"]
+FACTOR_COL = "S_DQ_ADJFACTOR"
+
+
+def adjust_prices(df, dtype=np.float64, decimals=1):
+    """
+    Calculate the four adjusted prices in one pass
+
+    The raw OHLC columns are multiplied by the adjust factor into a
+    single C-contiguous float64 block and rounded in place, the block
+    then backs the returned frame without further copies.
+
+    Params
+    ------
+    - df:
+        raw minute data of one contract, e.g. from `datastore.load`
+    - dtype:
+        np.float64 (default) or np.float32 for the output columns
+    - decimals:
+        number of decimals of the adjusted prices, same as `round(..., 1)`
+
+    Returns
+    -------
+    - adj_df: pd.DataFrame
+        S_DQ_ADJOPEN, S_DQ_ADJHIGH, S_DQ_ADJLOW, S_DQ_ADJCLOSE in this
+        order, i.e. columns 0-3 of the `bt.feeds.PandasData` subclasses
+    """
+    factor = df[FACTOR_COL].to_numpy(dtype=np.float64)
+    block = np.empty((len(df), len(PRE_COLS)), dtype=np.float64)
+
+    np.multiply(df[PRE_COLS].to_numpy(dtype=np.float64), factor[:, None], out=block)
+    np.round(block, decimals, out=block)
+
+    if dtype != np.float64:
+        block = block.astype(dtype)
+
+    return pd.DataFrame(block, index=df.index, columns=ADJ_COLS, copy=False)
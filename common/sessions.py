@@ -0,0 +1,181 @@
+# -*- coding: UTF-8 -*-
+# Trading sessions of the CFFEX index futures and session aligned bars
+#
+# Minute bars are labelled by their end time, i.e. the first bar of the
+# morning session is 09:16 before 2016-01-04 and 09:31 afterwards.
+
+import pandas as pd
+import numpy as np
+
+import datetime
+import functools
+
+from common.prices import ADJ_COLS
+
+# 中金所股指期货交易时间调整日
+ADJ_DATE = datetime.date(2016, 1, 4)
+
+# 上午/下午交易时段的开盘和收盘时间, 以距0点的分钟数表示
+SESSIONS_BEFORE = ((9 * 60 + 15, 11 * 60 + 30), (13 * 60, 15 * 60 + 15))
+SESSIONS_AFTER = ((9 * 60 + 30, 11 * 60 + 30), (13 * 60, 15 * 60))
+
+NS_PER_MINUTE = 60 * 10**9
+
+
+def session_table(dates):
+    """
+    Return the session open/close minutes of each date
+
+    Params
+    ------
+    - dates:
+        array-like of dates
+
+    Returns
+    -------
+    - table: np.ndarray
+        int64 array of shape (len(dates), 2, 2), table[i, s] holds the
+        (open, close) minutes of session s (0 morning, 1 afternoon)
+    """
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    after = dates >= np.datetime64(ADJ_DATE, "D")
+
+    return np.where(
+        after[:, None, None],
+        np.array(SESSIONS_AFTER, dtype=np.int64),
+        np.array(SESSIONS_BEFORE, dtype=np.int64),
+    )
+
+
+def minute2time(minute):
+    """Convert minutes since midnight to datetime.time"""
+    return datetime.time(int(minute) // 60, int(minute) % 60)
+
+
+# 策略逐bar查询当日的交易时间, 每个交易日只计算一次
+@functools.lru_cache(maxsize=4096)
+def trade_times(date):
+    """
+    Return the times of the first and last minute bars of both sessions,
+    (morning_open, morning_close, afternoon_open, afternoon_close)
+    """
+    (am_open, am_close), (pm_open, pm_close) = session_table([date])[0]
+
+    return tuple(minute2time(m) for m in (am_open + 1, am_close, pm_open + 1, pm_close))
+
+
+@functools.lru_cache(maxsize=4096)
+def session_length(date, session=0):
+    """Return the number of minute bars in the session of the date"""
+    start, end = session_table([date])[0, session]
+
+    return int(end - start)
+
+
+def resample_session(df, minutes):
+    """
+    Resample adjusted minute bars into bars aligned to the sessions
+
+    Each session of each day is cut into `minutes` long bins starting at
+    its open, the last bin of a session is shortened at the close. Bars are
+    labelled by the end of their bin and no bin crosses the lunch break,
+    so no empty bins are allocated and nothing has to be dropped.
+
+    Params
+    ------
+    - df:
+        adjusted minute prices with ADJ_COLS columns, sorted by time
+    - minutes:
+        length of the bars in minutes
+
+    Returns
+    -------
+    - bars: pd.DataFrame
+        OHLC bars with ADJ_COLS columns
+    """
+    df = df[ADJ_COLS].dropna()
+    stamps = df.index.values.astype("datetime64[ns]")
+
+    days = stamps.astype("datetime64[D]")
+    minute = (stamps - days).astype("timedelta64[m]").astype(np.int64)
+
+    # 所属交易时段的开盘和收盘时间
+    table = session_table(days)
+    afternoon = minute > table[:, 0, 1]
+    rows = np.arange(len(df))
+    start = table[rows, afternoon.astype(np.intp), 0]
+    end = table[rows, afternoon.astype(np.intp), 1]
+
+    # 每个bar所属区间的结束时间, 集合竞价等时段外的bar并入最近的区间
+    offset = np.clip(minute - start, 1, end - start)
+    label = np.minimum(start + -(-offset // minutes) * minutes, end)
+    keys = days.astype("datetime64[ns]").astype(np.int64) + label * NS_PER_MINUTE
+
+    # 相同标签的bar在时间上连续
+    first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    last = np.r_[first[1:], len(keys)] - 1
+
+    values = df.to_numpy(dtype=np.float64)
+    bars = np.empty((len(first), 4), dtype=np.float64)
+    bars[:, 0] = values[first, 0]
+    bars[:, 1] = np.maximum.reduceat(values[:, 1], first)
+    bars[:, 2] = np.minimum.reduceat(values[:, 2], first)
+    bars[:, 3] = values[last, 3]
+
+    index = pd.DatetimeIndex(keys[first].astype("datetime64[ns]"), name=df.index.name)
+
+    return pd.DataFrame(bars, index=index, columns=ADJ_COLS, copy=False)
+
+
+class TradingCalendar:
+    """
+    Per-day times of the first, last and last-but-one bar of a bar series
+
+    The times are stored as minutes since midnight in NumPy arrays indexed
+    by the day ordinal relative to the first day, so the times of the day
+    of a backtrader date number are found with one subtraction. Days
+    without bars hold -1.
+
+    Params
+    ------
+    - index:
+        pd.DatetimeIndex of the bars, sorted by time
+    """
+
+    # datetime64[D] counts days from 1970-01-01
+    EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+    def __init__(self, index):
+        stamps = np.asarray(index.values, dtype="datetime64[m]")
+        days = stamps.astype("datetime64[D]")
+        minute = (stamps - days).astype(np.int64)
+
+        first = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        last = np.r_[first[1:], len(days)] - 1
+        ordinal = days[first].astype(np.int64) + self.EPOCH_ORDINAL
+
+        self.start = int(ordinal[0])
+        size = int(ordinal[-1]) - self.start + 1
+        self.open = np.full(size, -1, dtype=np.int64)
+        self.close = np.full(size, -1, dtype=np.int64)
+        self.last_but_one = np.full(size, -1, dtype=np.int64)
+
+        pos = ordinal - self.start
+        self.open[pos] = minute[first]
+        self.close[pos] = minute[last]
+        # 当日只有一个bar时取该bar
+        self.last_but_one[pos] = minute[np.maximum(last - 1, first)]
+
+    def day(self, dtnum):
+        """Return the array position of the day of a backtrader date number"""
+        return int(dtnum) - self.start
+
+    @staticmethod
+    def minute(dtnum):
+        """Return the minutes since midnight of a backtrader date number"""
+        return int(round((dtnum % 1.0) * 1440))
+
+    def lookup(self, dtnum):
+        """Return (open, close, last_but_one) minutes of the day of dtnum"""
+        i = int(dtnum) - self.start
+        return self.open[i], self.close[i], self.last_but_one[i]
@@ -0,0 +1,391 @@
+# -*- coding: UTF-8 -*-
+# Parallel parameter sweeps
+#
+# cerebro.optstrategy pickles the strategy results of every combination
+# back to the parent and only returns once all of them are done. `sweep`
+# instead runs each combination as a plain backtest in a process pool:
+# the bar frames are copied once into shared memory and attached by every
+# worker, each worker only returns the metrics of its run and the parent
+# appends them to a csv file as soon as they arrive.
+#
+# The csv file is an append-only log of ResultSink rows keyed by the
+# parameters and the hash of the bar frames: an interrupted sweep is
+# resumed by running it again, combinations already in the file are
+# skipped, and `load_results` reads the finished rows at any time.
+
+import pandas as pd
+import numpy as np
+
+import io
+import os
+import sys
+import csv
+import math
+import hashlib
+import itertools
+import multiprocessing
+
+from multiprocessing import shared_memory
+
+
+class SharedFrames:
+    """
+    DataFrames copied once into shared memory
+
+    The values of each frame are stored column-major as float64, so the
+    columns of an attached frame are contiguous views of the shared block
+    and ArrayData reads them without a copy. The index keeps its dtype.
+
+    Params
+    ------
+    - frames: dict
+        name -> pd.DataFrame with numeric columns
+    """
+
+    def __init__(self, frames):
+        self.specs = {}
+        self._blocks = []
+
+        for name, df in frames.items():
+            values = self._share(df.to_numpy(dtype=np.float64), order="F")
+            index = self._share(df.index.values)
+            self.specs[name] = (values, index, list(df.columns), df.index.name)
+
+    def _share(self, array, order="C"):
+        """Copy an array into a new shared memory block, return its spec"""
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf, order=order)[...] = array
+        self._blocks.append(shm)
+
+        return shm.name, array.shape, array.dtype.str, order
+
+    def close(self):
+        """Release and remove the shared memory blocks"""
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _attach(spec, blocks):
+    name, shape, dtype, order = spec
+    shm = shared_memory.SharedMemory(name=name)
+    blocks.append(shm)
+
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf, order=order)
+
+
+def attach_frames(specs, blocks):
+    """
+    Return the DataFrames of `SharedFrames.specs` backed by the shared memory
+
+    The opened blocks are appended to `blocks`, which must be kept alive
+    as long as the frames are used.
+    """
+    frames = {}
+    for name, (values, index, columns, index_name) in specs.items():
+        index = pd.Index(_attach(index, blocks), name=index_name, copy=False)
+        frames[name] = pd.DataFrame(_attach(values, blocks), index=index, columns=columns, copy=False)
+
+    return frames
+
+
+# 工作进程的状态, 由 _init_worker 设置
+_worker = {}
+
+
+def _init_worker(specs, build, metrics):
+    # 各进程的交易日志不写入主进程的日志文件
+    sys.stdout = open(os.devnull, "w")
+
+    blocks = []
+    _worker.update(frames=attach_frames(specs, blocks), blocks=blocks, build=build, metrics=metrics)
+
+
+def _run_params(params):
+    cerebro = _worker["build"](frames=_worker["frames"], **params)
+    strat = cerebro.run()[0]
+
+    row = dict(params)
+    row.update(_worker["metrics"](strat))
+
+    return row
+
+
+def param_grid(grid):
+    """Return the combinations of a dict name -> values as a list of dicts"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+HASH_COL = "data_hash"
+
+
+def param_key(params, names):
+    """Return the values of the named parameters as compared in the csv file"""
+    return tuple(str(params[name]) for name in names)
+
+
+def frames_hash(frames):
+    """Return the sha1 hex digest of the names, columns, index and values of the frames"""
+    sha1 = hashlib.sha1()
+    for name, df in sorted(frames.items()):
+        sha1.update(repr((name, list(df.columns), df.shape)).encode())
+        sha1.update(np.ascontiguousarray(df.index.values).tobytes())
+        sha1.update(np.ascontiguousarray(df.to_numpy(dtype=np.float64)).tobytes())
+
+    return sha1.hexdigest()[:12]
+
+
+class ResultSink:
+    """
+    Append-only csv log of the sweep results
+
+    Every row holds the data hash, the parameters and the metrics of one
+    run and is flushed as soon as it is written, so a crash loses at most
+    the runs still in progress. A row cut off by a crash is dropped when
+    the file is opened again.
+
+    Params
+    ------
+    - path:
+        csv file of the results
+    - data_hash:
+        hash of the bar frames of the sweep, see `frames_hash`
+    - names:
+        parameter names of the sweep
+    """
+
+    def __init__(self, path, data_hash, names):
+        self.path = path
+        self.data_hash = data_hash
+        self.names = list(names)
+        self.fieldnames = None
+        self.done = set()
+
+        if os.path.exists(path):
+            self._repair()
+            with open(path, newline="") as f:
+                reader = csv.DictReader(f)
+                self.fieldnames = reader.fieldnames
+                if self.fieldnames and HASH_COL not in self.fieldnames:
+                    raise ValueError(f"{path} is not a results file of `sweep`")
+                for row in reader:
+                    if row[HASH_COL] == data_hash:
+                        self.done.add(self.key(row))
+
+    def _repair(self):
+        # 删除崩溃时未写完的最后一行
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def key(self, params):
+        """Return the key of a parameter dict, see `param_key`"""
+        return param_key(params, self.names)
+
+    def append(self, row):
+        """Write the row of a finished run"""
+        row = {HASH_COL: self.data_hash, **row}
+
+        with open(self.path, "a", newline="") as f:
+            if self.fieldnames is None or f.tell() == 0:
+                self.fieldnames = list(row)
+                csv.DictWriter(f, fieldnames=self.fieldnames).writeheader()
+            csv.DictWriter(f, fieldnames=self.fieldnames).writerow(row)
+
+        self.done.add(self.key(row))
+
+
+def load_results(path, data_hash=None):
+    """
+    Read the rows of a sweep, also while it is still running
+
+    Params
+    ------
+    - path:
+        csv file of the `ResultSink`
+    - data_hash:
+        keep the rows of these bar frames, default those of the last row
+
+    Returns
+    -------
+    - opt_df: pd.DataFrame
+        parameters and metrics, without the data hash column
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    # 跳过正在写入的最后一行
+    df = pd.read_csv(io.BytesIO(data[:data.rfind(b"\n") + 1]))
+    if df.empty:
+        return df.drop(columns=HASH_COL)
+
+    data_hash = data_hash or df[HASH_COL].iloc[-1]
+
+    return df[df[HASH_COL] == data_hash].drop(columns=HASH_COL).reset_index(drop=True)
+
+
+def run_combos(build, combos, metrics, frames, path, names, processes=None):
+    """
+    Run a backtest for every parameter dict of `combos` in a process pool
+
+    See `sweep` for the params, names are the parameter names keying the
+    rows of the `ResultSink`. Returns the rows of the combos.
+    """
+    data_hash = frames_hash(frames)
+    sink = ResultSink(path, data_hash, names)
+    todo = [params for params in combos if sink.key(params) not in sink.done]
+
+    if todo:
+        with SharedFrames(frames) as shared:
+            initargs = (shared.specs, build, metrics)
+            with multiprocessing.Pool(processes, initializer=_init_worker, initargs=initargs) as pool:
+                for row in pool.imap_unordered(_run_params, todo):
+                    sink.append(row)
+
+    # 只返回本次参数组合的结果
+    opt_df = load_results(path, data_hash)
+    keys = {sink.key(params) for params in combos}
+    opt_df = opt_df[[sink.key(row) in keys for row in opt_df.to_dict("records")]]
+
+    return opt_df.reset_index(drop=True)
+
+
+def sweep(build, grid, metrics, frames, path, processes=None):
+    """
+    Run a backtest for every parameter combination in a process pool
+
+    Params
+    ------
+    - build:
+        module level function build(frames=frames, **params) returning a
+        bt.Cerebro with one strategy, e.g. the `build_cerebro` of a strategy
+    - grid: dict
+        parameter name -> values, every combination is run
+    - metrics:
+        module level function metrics(strat) returning a dict of the
+        performance metrics of one run
+    - frames: dict
+        name -> pd.DataFrame of the bars passed to `build`
+    - path:
+        csv file of the `ResultSink` the rows are appended to as the
+        runs finish, combinations already in it are skipped
+    - processes:
+        number of workers, default os.cpu_count()
+
+    Returns
+    -------
+    - opt_df: pd.DataFrame
+        one row of parameters and metrics per combination of the grid
+    """
+    opt_df = run_combos(build, param_grid(grid), metrics, frames, path, list(grid), processes)
+
+    return opt_df.sort_values(list(grid), ignore_index=True)
+
+
+def calmar_score(ann_rets, max_drawdown):
+    """
+    Return the calmar ratio ann_rets / -max_drawdown used to rank the runs
+
+    A run without drawdown, frequent on the short date ranges of the first
+    rungs of `halving`, scores +inf if it gained and 0 otherwise instead of
+    -inf or nan, which would rank a profitable run without losses last.
+    """
+    if max_drawdown == 0:
+        return math.inf if ann_rets > 0 else 0.0
+
+    return ann_rets / -max_drawdown
+
+
+def span_years(rets):
+    """
+    Return the number of years spanned by the index of the returns,
+    i.e. of the date range actually run, at least one day
+    """
+    days = (rets.index[-1] - rets.index[0]) / pd.Timedelta(days=1)
+
+    return max(days, 1) / 365.25
+
+
+def date_window(frames, fromdate=None, todate=None):
+    """
+    Return the bars of the frames the feeds load between fromdate and
+    todate, i.e. whole days as the fromdate/todate params of the feeds,
+    so that the date prefixes of `halving` are taken in the backtest window
+    """
+    fromdate = fromdate.isoformat() if fromdate else None
+    todate = todate.isoformat() if todate else None
+
+    return {name: df.loc[fromdate:todate] for name, df in frames.items()}
+
+
+def date_prefix(frames, fraction):
+    """
+    Return the frames up to the same date, which keeps
+    the first `fraction` of the bars of the first frame
+    """
+    index = next(iter(frames.values())).index
+    end = index[max(math.ceil(len(index) * fraction), 1) - 1]
+
+    return {name: df.loc[:end] for name, df in frames.items()}
+
+
+def halving(build, grid, metrics, frames, path, score="calmar_ratio", eta=3, processes=None):
+    """
+    Successive halving search over growing date ranges
+
+    All combinations of the grid are first run on the earliest 1/eta^k of
+    the history, only the best 1/eta of them by `score` are run again on
+    eta times as many bars, until the last candidates run on the whole
+    history. With n combinations this costs about log_eta(n) full grid
+    backtests of n/eta^k bars each instead of n full backtests, e.g. 25
+    combinations and eta=3 run 25, 9 and 3 times on 1/9, 1/3 and all bars.
+
+    Params
+    ------
+    - build, grid, metrics, frames, processes:
+        see `sweep`, the frames only hold the bars of the backtest window
+        (see `date_window`), otherwise the first rungs run on bars the
+        feeds skip
+    - path:
+        csv file of the `ResultSink`, every date range has its own data
+        hash so all rungs share the file and an interrupted search resumes
+    - score:
+        metric to maximise, nan ranks last
+    - eta:
+        reduction factor between the rungs
+
+    Returns
+    -------
+    - opt_df: pd.DataFrame
+        rows of every rung with its number and fraction of the bars, the
+        rows of a rung are sorted by score, i.e. the best parameters are
+        the first row of the last rung
+    """
+    names = list(grid)
+    candidates = param_grid(grid)
+    rungs = int(math.floor(math.log(len(candidates), eta) + 1e-9)) + 1
+
+    results = []
+    for rung in range(rungs):
+        fraction = float(eta) ** (rung - rungs + 1)
+        opt_df = run_combos(build, candidates, metrics, date_prefix(frames, fraction), path, names, processes)
+        opt_df = opt_df.sort_values(score, ascending=False, na_position="last", kind="stable", ignore_index=True)
+
+        opt_df.insert(0, "rung", rung)
+        opt_df.insert(1, "fraction", fraction)
+        results.append(opt_df)
+
+        # 保留得分最高的 1/eta 组参数进入下一轮
+        best = {param_key(row, names) for row in opt_df.head(math.ceil(len(candidates) / eta)).to_dict("records")}
+        candidates = [params for params in candidates if param_key(params, names) in best]
+
+    return pd.concat(results, ignore_index=True)
@@ -0,0 +1,58 @@
+# -*- coding: UTF-8 -*-
+# The columnar store once data.csv is removed
+#
+# Run with: python -m pytest common
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common import datastore
+
+
+@pytest.fixture
+def store(tmp_path):
+    """A store built from a small data.csv of two contracts over two years"""
+    index = pd.DatetimeIndex(["2015-12-31 14:59", "2015-12-31 15:00", "2016-01-04 09:31", "2016-01-04 09:32"])
+    frames = []
+    for contract in ("IF00", "IC00"):
+        close = np.arange(len(index)) + 3000.0
+        frames.append(pd.DataFrame(
+                {"S_INFO_CODE": contract, "S_DQ_OPEN": close, "S_DQ_HIGH": close + 1, "S_DQ_LOW": close - 1,
+                 "S_DQ_CLOSE": close, "S_DQ_ADJFACTOR": 1.0, "S_DQ_VOLUME": 100.0},
+                index=pd.Index(index, name="TRADE_DT"),
+                ))
+
+    src, dest = str(tmp_path / "data.csv"), str(tmp_path / "store")
+    pd.concat(frames).to_csv(src)
+    manifest = datastore.build_store(src, dest)
+
+    return src, dest, manifest
+
+
+def test_load_without_source(store):
+    src, dest, manifest = store
+    expected = datastore.load("IF00", src=src, dest=dest)
+
+    os.rename(src, src + ".bak")
+    assert datastore.is_fresh(src, dest)
+    assert datastore.source_hash(src, dest) == manifest["sha1"]
+
+    df = datastore.load("IF00", src=src, dest=dest)
+    pd.testing.assert_frame_equal(df, expected)
+    assert len(df) == 4 and set(df["S_INFO_CODE"]) == {"IF00"}
+
+
+def test_rebuild_changed_source(store):
+    src, dest, manifest = store
+
+    with open(src, "a") as f:
+        f.write("2016-01-04 09:33:00,IF00,3004.0,3005.0,3003.0,3004.0,1.0,100.0\n")
+    assert not datastore.is_fresh(src, dest)
+
+    assert len(datastore.load("IF00", src=src, dest=dest)) == 5
+    assert datastore.source_hash(src, dest) != manifest["sha1"]
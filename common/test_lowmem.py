@@ -0,0 +1,92 @@
+# -*- coding: UTF-8 -*-
+# Low-memory runs trade exactly like full runs
+#
+# Run with: python -m pytest common
+
+import io
+import os
+import sys
+import contextlib
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.feeds import ArrayData
+from common.lowmem import LOWMEM, Lookback, cerebro_kwargs, check_lowmem
+
+
+def minute_bars(n=3000, seed=0):
+    """Random walk minute bars with the columns of PandasData"""
+    rng = np.random.default_rng(seed)
+    close = 3000 * np.exp(np.cumsum(rng.normal(0, 0.001, n)))
+    index = pd.date_range("2016-06-01 09:31", periods=n, freq="1min", name="datetime")
+
+    return pd.DataFrame(
+            {"open": np.r_[close[0], close[:-1]], "high": close * 1.0005, "low": close * 0.9995,
+             "close": close, "volume": 100.0},
+            index=index,
+            )
+
+
+def resample(df, minutes):
+    """Bars of `minutes` labelled by their end time, as common/sessions.py"""
+    agg = dict(open="first", high="max", low="min", close="last", volume="sum")
+    return df.resample(f"{minutes}min", closed="right", label="right").agg(agg).dropna()
+
+
+class Crossover(Lookback, bt.Strategy):
+    """Trades the SMA crossover of data0, filtered by the SMA slope of the other datas"""
+
+    params = dict(fast=10, slow=30, trend=5)
+
+    def lookback(self):
+        return 3
+
+    def __init__(self):
+        self.crossover = bt.ind.CrossOver(bt.ind.SMA(period=self.p.fast), bt.ind.SMA(period=self.p.slow))
+        self.trends = [bt.ind.SMA(data.close, period=self.p.trend) for data in self.datas[1:]]
+
+    def next(self):
+        # 直接读取前几个bar
+        rising = self.data.close[0] > self.data.close[-2]
+        up = all(trend[0] > trend[-1] for trend in self.trends)
+
+        if self.crossover[0] > 0 and rising and up:
+            self.order_target_percent(target=0.5)
+        elif self.crossover[0] < 0:
+            self.order_target_percent(target=-0.5)
+
+
+def build(frames, lowmem, kwargs=None):
+    cerebro = bt.Cerebro(**(cerebro_kwargs(lowmem, datas=len(frames)) if kwargs is None else kwargs))
+    for df in frames:
+        cerebro.adddata(ArrayData(dataname=df))
+    cerebro.addstrategy(Crossover)
+    cerebro.broker.setcash(1_000_000)
+
+    return cerebro
+
+
+def test_one_data():
+    """exactbars=1 with a single data"""
+    frames = [minute_bars()]
+    assert cerebro_kwargs(True, datas=1) == LOWMEM
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        trans = check_lowmem(lambda lowmem: build(frames, lowmem))
+    assert len(trans) > 10
+
+
+@pytest.mark.parametrize("minutes", [(5,), (5, 15)])
+def test_several_datas(minutes):
+    """exactbars=-1 with minute bars and longer bars, as RSI_backtest and turtle_trading"""
+    df = minute_bars()
+    frames = [df] + [resample(df, m) for m in minutes]
+    assert cerebro_kwargs(True, datas=len(frames)) == dict(exactbars=-1)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        trans = check_lowmem(lambda lowmem: build(frames, lowmem))
+    assert len(trans) > 10
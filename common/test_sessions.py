@@ -0,0 +1,77 @@
+# -*- coding: UTF-8 -*-
+# Labels of the session aligned bars used by RSI_backtest
+#
+# Run with: python -m pytest common
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.prices import ADJ_COLS
+from common.sessions import resample_session
+
+
+def minute_bars(day, sessions):
+    """Minute bars of one day labelled by their end time, the close rising by 1 per bar"""
+    stamps = []
+    for start, end in sessions:
+        stamps += pd.date_range(f"{day} {start}", f"{day} {end}", freq="1min", inclusive="right").tolist()
+
+    close = np.arange(len(stamps)) + 3000.0
+    df = pd.DataFrame(
+            {ADJ_COLS[0]: close - 0.5, ADJ_COLS[1]: close + 1, ADJ_COLS[2]: close - 1, ADJ_COLS[3]: close},
+            index=pd.DatetimeIndex(stamps, name="TRADE_DT"),
+            )
+
+    return df
+
+
+# (日期, 交易时段, bar分钟数, 上午开盘后第一个bar, 上午收盘bar, 下午开盘后第一个bar, 收盘bar, bar数)
+CASES = [
+    ("2015-06-01", (("09:15", "11:30"), ("13:00", "15:15")), 5, "09:20", "11:30", "13:05", "15:15", 54),
+    ("2015-06-01", (("09:15", "11:30"), ("13:00", "15:15")), 15, "09:30", "11:30", "13:15", "15:15", 18),
+    ("2016-06-01", (("09:30", "11:30"), ("13:00", "15:00")), 5, "09:35", "11:30", "13:05", "15:00", 48),
+    ("2016-06-01", (("09:30", "11:30"), ("13:00", "15:00")), 15, "09:45", "11:30", "13:15", "15:00", 16),
+]
+
+
+@pytest.mark.parametrize("day, sessions, minutes, first, lunch, reopen, close, count", CASES)
+def test_labels(day, sessions, minutes, first, lunch, reopen, close, count):
+    bars = resample_session(minute_bars(day, sessions), minutes)
+    labels = bars.index.strftime("%H:%M").tolist()
+
+    # bar以区间结束时间标记, 不跨越午休和收盘
+    assert len(labels) == count
+    assert labels[0] == first
+    assert labels[labels.index(lunch) + 1] == reopen
+    assert labels[-1] == close
+    assert not any("11:30" < label <= "13:00" for label in labels)
+
+
+def test_bar_values():
+    df = minute_bars("2016-06-01", (("09:30", "11:30"), ("13:00", "15:00")))
+    bars = resample_session(df, 15)
+
+    # 09:45的bar由09:31-09:45的分钟bar组成, 不含09:46
+    first = df.loc["2016-06-01 09:31":"2016-06-01 09:45"]
+    assert bars.index[0] == pd.Timestamp("2016-06-01 09:45")
+    assert bars.iloc[0].tolist() == [
+        first[ADJ_COLS[0]].iloc[0], first[ADJ_COLS[1]].max(), first[ADJ_COLS[2]].min(), first[ADJ_COLS[3]].iloc[-1],
+    ]
+
+    # 下午第一个bar从13:01开始
+    reopen = df.loc["2016-06-01 13:01":"2016-06-01 13:15"]
+    assert bars.loc["2016-06-01 13:15", ADJ_COLS[0]] == reopen[ADJ_COLS[0]].iloc[0]
+
+
+def test_auction_bar():
+    """A bar at the open, e.g. of the call auction, joins the first bin"""
+    df = minute_bars("2016-06-01", (("09:29", "11:30"), ("13:00", "15:00")))
+    bars = resample_session(df, 5)
+
+    assert bars.index[0] == pd.Timestamp("2016-06-01 09:35")
+    assert bars[ADJ_COLS[0]].iloc[0] == df.loc["2016-06-01 09:30", ADJ_COLS[0]]
@@ -0,0 +1,62 @@
+# -*- coding: UTF-8 -*-
+# Ranking of the successive halving search
+#
+# Run with: python -m pytest common
+
+import math
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.sweep import calmar_score, halving
+
+
+# 各参数组合的年化收益率和最大回撤, 组合0没有回撤
+RUNS = {
+    0: (0.05, 0.0),
+    1: (0.20, -0.10),
+    2: (0.15, -0.10),
+    3: (0.10, -0.10),
+    4: (0.05, -0.10),
+    5: (-0.05, -0.10),
+    6: (0.0, 0.0),
+    7: (-0.10, -0.20),
+    8: (0.01, -0.10),
+}
+
+
+class FakeCerebro:
+    """Stands in for bt.Cerebro, run() returns itself as the strategy"""
+
+    def __init__(self, frames, combo):
+        self.combo = combo
+
+    def run(self):
+        return [self]
+
+
+def metrics(strat):
+    ann_rets, max_drawdown = RUNS[strat.combo]
+    return dict(ann_rets=ann_rets, max_drawdown=max_drawdown, calmar_ratio=calmar_score(ann_rets, max_drawdown))
+
+
+def test_calmar_score():
+    assert calmar_score(0.1, -0.05) == 2.0
+    assert calmar_score(0.1, 0.0) == math.inf
+    assert calmar_score(0.0, 0.0) == 0.0
+    assert calmar_score(-0.1, 0.0) == 0.0
+
+
+def test_zero_drawdown_survives(tmp_path):
+    frames = {"bars": pd.DataFrame({"close": np.arange(90.0)}, index=pd.date_range("2020-01-01", periods=90))}
+    opt_df = halving(FakeCerebro, dict(combo=list(RUNS)), metrics, frames, str(tmp_path / "opt.csv"), processes=1)
+
+    # 没有回撤的盈利组合排在每一轮的首位
+    for _, rung in opt_df.groupby("rung"):
+        assert rung["combo"].iloc[0] == 0
+        assert rung["calmar_ratio"].iloc[0] == math.inf
+
+    assert opt_df["rung"].max() == 2
@@ -4,6 +4,7 @@ import pandas as pd
 
 import os
 import datetime
+from ast import literal_eval
 
 class Contract:
 
@@ -48,6 +49,7 @@ class Contract:
                 os.path.abspath("."),
                 "1m_main_contracts", self.contract + ".csv"
                 )  # 1min data
+        self.memmap_path = os.path.splitext(self.filepath)[0] + ".npy"  # 内存映射文件
 
         # 初始资金
         self.startcash = 10_000_000
@@ -65,11 +67,51 @@ class Contract:
         self.window = 8
 
     def get_timedf(self, path):
-        """Return the time df that contains the trading bars per day"""
-        timedf = pd.read_csv(path, index_col='date')
+        """
+        Return the time df that contains the first and the
+        last-but-one trading bar per day as offsets from midnight
+
+        The stringified time lists are parsed once here instead
+        of on every bar of the backtest
+        """
+        timedf = pd.read_csv(path, index_col='date', converters={'time': literal_eval})
         timedf.index = pd.to_datetime(timedf.index)
 
-        return timedf
+        times = timedf['time']
+        return pd.DataFrame(
+            {
+                'open': pd.to_timedelta(times.str[0]),  # 开盘bar
+                'close_signal': pd.to_timedelta(times.str[-2]),  # 在收盘前一个bar发出平仓信号
+            },
+            index=timedf.index,
+        )
+
+    def add_time_flags(self, df):
+        """
+        Add the per-bar flags is_open_bar and is_close_signal_bar
+        to the minute data, 1.0 if the bar is the first or the
+        last-but-one trading bar of the day
+        """
+        day = df.index.normalize()
+        offset = df.index - day
+        times = self.time_df.reindex(day)
+
+        out = df.copy()
+        out['is_open_bar'] = (offset == times['open'].values).astype(float)
+        out['is_close_signal_bar'] = (offset == times['close_signal'].values).astype(float)
+
+        return out
+
+    def load_data(self, cols):
+        """
+        Load the minute data of the contract with
+        the specified columns and the time flags
+        """
+        df = pd.read_csv(self.filepath, index_col="TRADE_DT")
+        df = df[cols]
+        df.index = pd.to_datetime(df.index)
+
+        return self.add_time_flags(df)
 
     def set_margin(self, contract):
         # 保证金设置
@@ -12,10 +12,16 @@ import empyrical as emp
 import datetime
 import math
 import csv
+import array
+import collections
 import os, sys
 
 import config
-from ast import literal_eval
+
+sys.path.append(os.path.abspath(".."))
+from common.feeds import ArrayData, MemmapData, write_memmap
+from common.lowmem import Lookback, cerebro_kwargs
+from common.sweep import calmar_score, date_window, halving, span_years
 
 
 var = config.set_contract_var()
@@ -41,12 +47,168 @@ class Logger:
         pass
 
 
-class CumNoise(bt.Strategy):
+def rolling_cum_noise(close, period, window):
+    """
+    向量化计算整段收盘价序列的噪声累积量及其标准差
+
+    Params
+    ------
+    close: 收盘价序列
+    period: 移动平均区间
+    window: 累积噪声量区间
+
+    Returns
+    -------
+    (cumnoise, std): 与close等长的数组, 前 period + window - 2 个值为nan
+    """
+    close = np.asarray(close, dtype=np.float64)
+    cumnoise = np.full(len(close), np.nan)
+    std = np.full(len(close), np.nan)
+
+    first = period + window - 2
+    if len(close) <= first:
+        return cumnoise, std
+
+    rolling = np.lib.stride_tricks.sliding_window_view(close, period)
+    noise = close[period - 1:] - rolling.mean(axis=1)
+    variance = rolling.var(axis=1, ddof=1)
+
+    cumnoise[first:] = np.lib.stride_tricks.sliding_window_view(noise, window).sum(axis=1)
+    std[first:] = np.sqrt(np.lib.stride_tricks.sliding_window_view(variance, window).sum(axis=1))
+
+    return cumnoise, std
+
+
+def precompute_signals(df, period=var.period, window=var.window, nstd=2, col="S_DQ_ADJCLOSE"):
+    """
+    在回测前一次性计算全部分钟bar的开仓信号, 作为数据的额外列
+
+    Params
+    ------
+    df: 分钟数据
+    period: 移动平均区间
+    window: 累积噪声量区间
+    nstd: 信号阈值为nstd倍累积量标准差
+
+    Returns
+    -------
+    增加long_sig/short_sig列(1.0/0.0)的数据
+    """
+    cumnoise, std = rolling_cum_noise(df[col].to_numpy(), period, window)
+
+    out = df.copy()
+    out["long_sig"] = (cumnoise > nstd * std).astype(float)
+    out["short_sig"] = (cumnoise < -nstd * std).astype(float)
+
+    return out
+
+
+def signal_memmap_path(path, period, window, nstd):
+    """
+    预计算信号的内存映射文件路径, 文件名包含计算信号的参数,
+    参数改变后不会读到按旧参数计算的long_sig/short_sig
+
+    Params
+    ------
+    path: 内存映射文件的基础路径, 即 var.memmap_path
+    period, window, nstd: 见 precompute_signals
+    """
+    root, ext = os.path.splitext(path)
+
+    return f"{root}_p{period}_w{window}_n{nstd}{ext}"
+
+
+def signal_density(df):
+    """
+    统计预计算信号的密度, 无需运行回测
+
+    Returns
+    -------
+    每日多头/空头信号的bar数及其占比
+    """
+    days = df.index.normalize()
+    daily = df[["long_sig", "short_sig"]].groupby(days).agg(["sum", "mean"])
+    daily.columns = ["long_bars", "long_ratio", "short_bars", "short_ratio"]
+
+    return daily
+
+
+class CumulativeNoise(bt.Indicator):
+    """
+    收盘价噪声累积量及其标准差
+
+    - cumnoise: 过去window个bar的噪声之和, 噪声为收盘价与period期移动平均之差
+    - std: window个period期移动方差之和的平方根
+
+    next() 以滚动求和逐bar更新, once() 对整段序列向量化计算
+    """
+
+    lines = ("cumnoise", "std")
+    params = dict(
+        period=var.period,  # 移动平均区间
+        window=var.window,  # 累积窗口
+    )
+
+    def __init__(self):
+        self.addminperiod(self.p.period + self.p.window - 1)
+
+        # 以首个收盘价为基准平移, 减小平方和的舍入误差
+        self._shift = None
+        self._sum = self._sumsq = 0.0
+        self._noise = collections.deque()
+        self._var = collections.deque()
+        self._noisesum = self._varsum = 0.0
+
+    def _update(self):
+        period = self.p.period
+        if self._shift is None:
+            self._shift = self.data[0]
+
+        x = self.data[0] - self._shift
+        self._sum += x
+        self._sumsq += x * x
+        if len(self) > period:
+            old = self.data[-period] - self._shift
+            self._sum -= old
+            self._sumsq -= old * old
+        if len(self) < period:
+            return
+
+        mean = self._sum / period
+        noise = x - mean
+        variance = (self._sumsq - self._sum * mean) / (period - 1)
+
+        self._noise.append(noise)
+        self._var.append(variance)
+        self._noisesum += noise
+        self._varsum += variance
+        if len(self._noise) > self.p.window:
+            self._noisesum -= self._noise.popleft()
+            self._varsum -= self._var.popleft()
+
+    def prenext(self):
+        self._update()
+
+    def next(self):
+        self._update()
+        self.lines.cumnoise[0] = self._noisesum
+        self.lines.std[0] = math.sqrt(max(self._varsum, 0.0))
+
+    def once(self, start, end):
+        cumnoise, std = rolling_cum_noise(self.data.array[:end], self.p.period, self.p.window)
+
+        self.lines.cumnoise.array[start:end] = array.array("d", cumnoise[start:end])
+        self.lines.std.array[start:end] = array.array("d", std[start:end])
+
+
+class CumNoise(Lookback, bt.Strategy):
     params = dict(
         period=var.period,  # 移动平均区间
         window=var.window,  # 累积窗口
         close_limit=0.02,  # 平仓限额
         target_percent=0.30,  # 目标订单比例
+        presignal=False,  # 使用数据中预计算的long_sig/short_sig
+        stats_path="results.csv",  # Observers数据写入的文件, None时不写入
     )
 
     def __init__(self):
@@ -65,6 +227,14 @@ class CumNoise(bt.Strategy):
         # 控制下单时间
         self.ordermin = None
 
+        # 噪声累积量及其标准差
+        if not self.p.presignal:
+            self.cumnoise = CumulativeNoise(self.dataclose, period=self.p.period, window=self.p.window)
+
+    def lookback(self):
+        # write_obs(-1) 读取前一个bar
+        return 2
+
     def log(self, txt, dt=None):
         dt = dt or self.datadatetime.datetime(0)
         print(dt, txt)
@@ -122,7 +292,11 @@ class CumNoise(bt.Strategy):
     def start(self):
         """开始前运行"""
         # Observers数据写入本地文件
-        self.mystats = csv.writer(open("results.csv", "w"))
+        if self.p.stats_path is None:
+            self.mystats = None
+            return
+
+        self.mystats = csv.writer(open(self.p.stats_path, "w"))
         self.mystats.writerow(
             [
                 "datetime",
@@ -138,17 +312,18 @@ class CumNoise(bt.Strategy):
             ]
         )
 
+    def prenext(self):
+        """指标计算完成前同样记录开盘价"""
+        self.next()
+
     def next(self):
         """回测开始后的每个bar运行"""
         # 当天的交易时间段
-        today = bt.num2date(self.datadatetime[0]).date()
-        trading_period = literal_eval(self.get_tradetime(today).values[0])
-        open_time = trading_period[0]  # open price for stoplimit
-        close_time = trading_period[-2]  # 在收盘前一个bar发出平仓信号
+        is_close_bar = self.datas[0].is_close_signal_bar[0]  # 在收盘前一个bar发出平仓信号
         now = bt.num2time(self.datadatetime[0]).isoformat()
 
         # 记录开盘价
-        if now == open_time:
+        if self.datas[0].is_open_bar[0]:  # open price for stoplimit
             self.dayopen = self.dataopen[0]
 
         # 符合一下任一条件时跳过当前交易日
@@ -161,29 +336,31 @@ class CumNoise(bt.Strategy):
             return
 
         # 计算交易信号
-        # 噪声累积量
-        cum_noise = self.get_cum_noise(self.dataclose, self.p.period, self.p.window)
+        if self.p.presignal:
+            long_sig = self.datas[0].long_sig[0] > 0
+            short_sig = self.datas[0].short_sig[0] > 0
+        else:
+            # 噪声累积量
+            cum_noise = self.cumnoise.cumnoise[0]
 
-        # 累积量标准差
-        cum_noise_std = math.sqrt(
-            math.fsum([self.get_moving_std(i, self.dataclose, self.p.period) ** 2 for i in range(self.p.window)])
-        )
+            # 累积量标准差
+            cum_noise_std = self.cumnoise.std[0]
 
-        # +/- 2x std
-        long_sig = cum_noise > 2 * cum_noise_std
-        short_sig = cum_noise < -2 * cum_noise_std
+            # +/- 2x std
+            long_sig = cum_noise > 2 * cum_noise_std
+            short_sig = cum_noise < -2 * cum_noise_std
 
         # 下订单
         var.closeout_type = 0
         # 开仓逻辑
-        if not self.position and now != close_time:
+        if not self.position and not is_close_bar:
             if long_sig:
                 self.order = self.order_target_percent(target=self.p.target_percent)
             elif short_sig:
                 self.order = self.order_target_percent(target=-self.p.target_percent)
         else: 
             # 平今仓
-            if now == close_time and self.position:
+            if is_close_bar and self.position:
                 var.closeout_type = 1
                 self.order = self.close()
                 self.order.addinfo(name="CLOSE OUT AT THE END OF DAY")
@@ -205,47 +382,14 @@ class CumNoise(bt.Strategy):
         """回测结束后的最后一个bar运行"""
         self.write_obs(0)
 
-    def get_tradetime(self, today):
-        """获取当日所有交易时间点"""
-        return var.time_df.loc[today.isoformat()]
-
-    def get_cum_noise(self, data, nper, window):
-        """
-        计算当天时间点收盘价的累积噪声量
-
-        Params
-        ------
-        data: 收盘价序列
-        nper: 移动平均区间
-        window: 累积噪声量区间
-        """
-        cum_noise = 0
-        for t in range(window):
-            sma = math.fsum(data.get(ago=-t, size=nper)) / nper
-            if sma == 0:  # no sma because of lacking data
-                noise = 0
-            else:
-                noise = data[-t] - sma
-            cum_noise += noise
-
-        return cum_noise
-
-    def get_moving_std(self, t, data, nper):
-        """
-        计算t时间点下噪声的移动标准差
-
-        Params
-        ------
-        t: 当前返回结果基于前t个时间点
-        data: 收盘价序列
-        nper: 移动平均的周期
-        """
-        return np.std(data.get(ago=-t, size=nper), ddof=1)
-
     def write_obs(self, t):
+        if self.mystats is None:
+            return
+
         self.mystats.writerow(
             [
-                self.datadatetime.datetime(t).strftime("%Y-%m-%d %H:%M:%S"),
+                # 策略自身的datetime, 低内存模式下stop()中仍可读取
+                self.datetime.datetime(t).strftime("%Y-%m-%d %H:%M:%S"),
                 self.stats.drawdown.drawdown[0],
                 self.stats.drawdown.maxdrawdown[0],
                 self.stats.timereturn.timereturn[0],
@@ -339,7 +483,8 @@ class ValueSizer(bt.Sizer):
         return min(size, data.volume[0])  # 取计算所得值和当天成交量的最小值
 
 
-class InputData(bt.feeds.PandasData):
+class InputData(ArrayData):
+    lines = ("is_open_bar", "is_close_signal_bar", "long_sig", "short_sig")
     params = dict(
         fromdate=var._fromdate,
         todate=var._todate,
@@ -351,33 +496,50 @@ class InputData(bt.feeds.PandasData):
         close=3,
         volume=4,
         openinterest=-1,
+        is_open_bar=5,
+        is_close_signal_bar=6,
+        long_sig=-1,  # 按列名自动匹配, 无预计算信号时为nan
+        short_sig=-1,
     )
 
-        
 
-if __name__ == "__main__":
-    # 将打印内容保存到本地
-    sys.stdout = Logger()
+class MemmapInput(MemmapData):
+    """从内存映射文件逐bar读取的分钟数据, 字段见`MEMMAP_FIELDS`"""
 
-    # 数据预处理
-    cols = [
-        "S_DQ_ADJOPEN",
-        "S_DQ_ADJHIGH",
-        "S_DQ_ADJLOW",
-        "S_DQ_ADJCLOSE",
-        "S_DQ_VOLUME",
-    ]
+    lines = ("is_open_bar", "is_close_signal_bar", "long_sig", "short_sig")
+    params = dict(
+        fromdate=var._fromdate,
+        todate=var._todate,
+    )
+
+
+# 内存映射文件的字段: line名 -> 预计算信号后数据的列
+MEMMAP_FIELDS = dict(
+    open=0,
+    high=1,
+    low=2,
+    close=3,
+    volume=4,
+    is_open_bar="is_open_bar",
+    is_close_signal_bar="is_close_signal_bar",
+    long_sig="long_sig",
+    short_sig="short_sig",
+)
 
-    filename = var.contract + ".csv"
-    # filepath = os.path.join(os.path.curdir, '5m_main_contracts', filename)
-    filepath = os.path.join(os.path.curdir, "1m_main_contracts", filename)
-    df = pd.read_csv(filepath, index_col="TRADE_DT")
-    df = df[cols]
-    df.index = pd.to_datetime(df.index)
-    data = InputData(dataname=df)
+        
+
+def build_cerebro(data, presignal=False, lowmem=False, **params):
+    """
+    Set up the backtest of a data feed
 
-    cerebro = bt.Cerebro()
-    cerebro.addstrategy(CumNoise)
+    lowmem=True bounds every line buffer to the indicator periods
+    (exactbars=1, see common/lowmem.py), `check_lowmem` verifies that
+    it trades exactly like the full run, e.g.
+    check_lowmem(lambda lowmem: build_cerebro(InputData(dataname=df), True, lowmem)).
+    params are passed to the strategy.
+    """
+    cerebro = bt.Cerebro(**cerebro_kwargs(lowmem))  # exactbars下不预加载数据
+    cerebro.addstrategy(CumNoise, presignal=presignal, **params)
 
     cerebro.adddata(data)
     # cerebro.broker.set_coc(True)  # cheat on close 以当日收盘价买入
@@ -402,6 +564,111 @@ if __name__ == "__main__":
     cerebro.addobserver(bt.observers.DrawDown)
     cerebro.addobserver(bt.observers.TimeReturn)
 
+    return cerebro
+
+
+def build_search(frames, **params):
+    """Set up the backtest of the parameters with precomputed signals, used by search()"""
+    period = params.get("period", CumNoise.params.period)
+    window = params.get("window", CumNoise.params.window)
+    df = precompute_signals(frames["bars"], period, window)
+
+    return build_cerebro(InputData(dataname=df), presignal=True, stats_path=None, **params)
+
+
+def opt_metrics(result):
+    """Performance metrics of one run of the optimisation"""
+    rets = pd.Series(result.analyzers._TimeReturn.get_analysis())
+    cumrets = emp.cum_returns(rets, starting_value=0)
+    max_drawdown = emp.max_drawdown(rets)
+
+    num_years = span_years(rets)
+    ann_rets = (1 + cumrets.iloc[-1]) ** (1 / num_years) - 1
+    yearly_trade_times = rets.shape[0] / num_years
+    sharpe = emp.sharpe_ratio(rets, risk_free=0, annualization=yearly_trade_times)
+
+    return dict(
+        cumrets=cumrets.iloc[-1],
+        ann_rets=ann_rets,
+        max_drawdown=max_drawdown,
+        calmar_ratio=calmar_score(ann_rets, max_drawdown),
+        sharpe=sharpe,
+    )
+
+
+def search(df, processes=None):
+    """
+    Search the parameters with the best calmar ratio by successive
+    halving over growing date ranges, see common/sweep.py
+
+    Params
+    ------
+    df: 含开盘/收盘信号bar标记的分钟数据, 即 var.load_data(cols)
+    """
+    grid = dict(
+        period=(10, 14, 20, 30),
+        window=(5, 8, 12),
+        close_limit=(0.01, 0.02, 0.03),
+        target_percent=(0.2, 0.3),
+    )
+
+    # 只在回测区间内取前缀
+    frames = date_window({"bars": df}, var._fromdate, var._todate)
+
+    opt_df = halving(build_search, grid, opt_metrics, frames, "./opt_search.csv", processes=processes)
+    print(opt_df)
+
+    return opt_df
+
+
+if __name__ == "__main__":
+    # 将打印内容保存到本地
+    sys.stdout = Logger()
+
+    # 数据预处理
+    cols = [
+        "S_DQ_ADJOPEN",
+        "S_DQ_ADJHIGH",
+        "S_DQ_ADJLOW",
+        "S_DQ_ADJCLOSE",
+        "S_DQ_VOLUME",
+    ]
+
+    # 预计算开仓信号
+    presignal = True
+    # 从内存映射文件读取数据, 内存中只保留回测所需的bar
+    use_memmap = False
+    # 限制各line的缓存长度, 见 common/lowmem.py
+    lowmem = False
+
+    # 参数寻优
+    # search(var.load_data(cols))
+
+    # 信号参数不同时使用不同的内存映射文件
+    signal_params = dict(period=CumNoise.params.period, window=CumNoise.params.window, nstd=2)
+    memmap_path = signal_memmap_path(var.memmap_path, **signal_params)
+
+    memmap_fresh = os.path.exists(memmap_path) and os.path.getmtime(memmap_path) >= os.path.getmtime(var.filepath)
+    if use_memmap and memmap_fresh:
+        data = MemmapInput(dataname=memmap_path)
+    else:
+        df = var.load_data(cols)  # 含开盘/收盘信号bar标记
+        if presignal or use_memmap:
+            df = precompute_signals(df, **signal_params)
+            density = signal_density(df)
+            print(density.describe())
+
+        if use_memmap:
+            # 首次运行时转换为内存映射文件
+            write_memmap(df, memmap_path, MEMMAP_FIELDS)
+            del df
+            data = MemmapInput(dataname=memmap_path)
+        else:
+            data = InputData(dataname=df)
+
+    # 内存映射数据只在 exactbars 下逐bar读取
+    cerebro = build_cerebro(data, presignal=presignal, lowmem=use_memmap or lowmem)
+
     # 开始回测
     init_msg = f"""
             回测对象: {var.contract}
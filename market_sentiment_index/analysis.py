@@ -7,7 +7,7 @@ import matplotlib.ticker as mticker
 import matplotlib.dates as mdates
 import seaborn as sns
 import datetime
-from main import Config
+from main import metavar  # frames are built lazily and shared with main
 
 
 plt.rcParams["axes.unicode_minus"] = False  # display minus sign correctly
@@ -323,8 +323,6 @@ def plot_rets_hist(rets):
 
 
 if __name__ == "__main__":
-    metavar = Config()
-
     rets_file = "./results/timereturn.csv"
     # opt_resulst = "./results/opt_results.csv"
 
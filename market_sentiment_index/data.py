@@ -1,69 +1,69 @@
 import pandas as pd
 import numpy as np
 
+import os, sys
+
+sys.path.append(os.path.abspath(".."))
+from common import datastore
+from common.prices import adjust_prices
+
 
 def create_df(data, contract):
     """
     Convert the raw .csv file into the target
     dataframe with specified frequency
     """
-    df = data[data["S_INFO_CODE"] == contract]
-
-    adj_cols = [
-        "S_DQ_ADJOPEN",
-        "S_DQ_ADJHIGH",
-        "S_DQ_ADJLOW",
-        "S_DQ_ADJCLOSE",
-    ]
-    pre_cols = ["S_DQ_OPEN", "S_DQ_HIGH", "S_DQ_LOW", "S_DQ_CLOSE"]
-
-    for pre_col, adj_col in zip(pre_cols, adj_cols):
-        df.loc[:, adj_col] = round(df.loc[:, pre_col] * df.loc[:, "S_DQ_ADJFACTOR"], 1)
-    df = df[adj_cols]
-
-    return df
+    return adjust_prices(data)  # data only holds the contract
 
 
-def daily_msi(df):
-    # dates = np.unique(df.index.date)
-    df = df['S_DQ_ADJCLOSE']
-    df = df.groupby(by=df.index.date).apply(msi)
+def daily_msi(df, nbars=50):
+    """
+    Calculate the market sentiment index of every day in one pass
 
-    return df
+    The first `nbars` closes of each day are laid out in a (days x nbars)
+    matrix padded with nan. For each bar the largest drawdown and rebound
+    against any earlier bar of the day follow from the running max/min,
 
+        max_j (p_j - p_i) / p_j = (runmax_i - p_i) / runmax_i
+        -min_j (p_j - p_i) / p_j = (p_i - runmin_i) / runmin_i
 
-def msi(p):
-    """
-    Calculate the market sentiment index of a given time
+    and the daily msi is the smaller of their means.
 
     Params
     ------
-    - prices: pd.Series
-        Prices series of the observed period
+    - df: pd.DataFrame
+        adjusted prices with the S_DQ_ADJCLOSE column
+    - nbars: int
+        number of bars observed from the open
 
     Returns
     -------
-    - msi: float
+    - msi: pd.Series
+        msi indexed by date
     """
-    p = p[:50]
-    mdd, rev_mdd = [], []
-    for i in range(len(p)):
-        price_change = (p[: i + 1] - p[i]) / p[: i + 1]
-        mdd.append(np.max(price_change))
-        rev_mdd.append(-np.min(price_change))
+    close = df['S_DQ_ADJCLOSE'].to_numpy(dtype=np.float64)
+    days, dates = pd.factorize(df.index.date)
+
+    # 每个bar在当日的位置
+    first = np.r_[0, np.flatnonzero(np.diff(days)) + 1]
+    pos = np.arange(len(days)) - np.repeat(first, np.diff(np.r_[first, len(days)]))
+    keep = pos < nbars
+
+    p = np.full((len(dates), nbars), np.nan)
+    p[days[keep], pos[keep]] = close[keep]
 
-    avg_mdd = np.mean(mdd)
-    avg_rev_mdd = np.mean(rev_mdd)
+    runmax = np.fmax.accumulate(p, axis=1)
+    runmin = np.fmin.accumulate(p, axis=1)
+    mdd = np.nanmean((runmax - p) / runmax, axis=1)
+    rev_mdd = np.nanmean((p - runmin) / runmin, axis=1)
 
-    return min(avg_mdd, avg_rev_mdd)
+    return pd.Series(np.minimum(mdd, rev_mdd), index=dates, name='S_DQ_ADJCLOSE')
 
 
 if __name__ == "__main__":
     valid_contracts = ['IF00', 'IH00', 'IC00']
-    path = "../data.csv"
-    data = pd.read_csv(path, index_col="TRADE_DT", parse_dates=True)
 
     for contract in valid_contracts:
-        df = create_df(data, contract)
+        df = create_df(datastore.load(contract), contract)
         msi_df = daily_msi(df)
         msi_df.to_csv(f'./{contract}_msi.csv', index=True, index_label='Date')
@@ -13,17 +13,22 @@ import os, sys
 import datetime
 import warnings
 
+sys.path.append(os.path.abspath(".."))
+from common import datastore, sessions
+from common.feeds import ArrayData
+from common.features import broadcast_daily
+from common.lazy import lazyframe
+from common.lowmem import cerebro_kwargs
+from common.prices import adjust_prices
+
 warnings.filterwarnings("ignore")
 
 
 class Config:
 
-    data_path = os.path.abspath("../data.csv")
-    data = pd.read_csv(data_path, index_col="TRADE_DT", parse_dates=True)
     valid_contracts = ["IF00", "IH00", "IC00"]
     contract = valid_contracts[0]
     msi_path = os.path.abspath(f"./{contract}_msi.csv")
-    msi_df = pd.read_csv(msi_path, index_col='Date', parse_dates=True)
 
     fromdate = datetime.date(2010, 4, 16)
     todate = datetime.date(2010, 4, 18)
@@ -36,32 +41,39 @@ class Config:
     is_ctp = False  # 平今仓
 
     def __init__(self):
-        self.df = self.create_df(self.data, self.contract)
-        self.df = self.add_msi(self.msi_df, self.df)
-        self.time_df = self.create_timedf(self.df)
         self.mult = self.set_mult()
         self.margin = self.set_margin()
 
+    # lazyframe 的缓存键: 各帧所依赖的属性
+    memo_attrs = ('contract', 'msi_path', 'fromdate', 'todate')
+
+    @lazyframe
+    def data(self):
+        """Minute data of the contract within the backtest period"""
+        return datastore.load(self.contract, self.fromdate, self.todate)
+
+    @lazyframe
+    def msi_df(self):
+        return pd.read_csv(self.msi_path, index_col='Date', parse_dates=True)
+
+    @lazyframe
+    def prices(self):
+        return self.create_df(self.data, self.contract)
+
+    @lazyframe
+    def df(self):
+        return self.add_msi(self.msi_df, self.prices)
+
+    @lazyframe
+    def time_df(self):
+        return self.create_timedf(self.df)
+
     def create_df(self, data, contract):
         """
         Convert the raw .csv file into the target
         dataframe with specified frequency
         """
-        df = data[data["S_INFO_CODE"] == contract]
-
-        adj_cols = [
-            "S_DQ_ADJOPEN",
-            "S_DQ_ADJHIGH",
-            "S_DQ_ADJLOW",
-            "S_DQ_ADJCLOSE",
-        ]
-        pre_cols = ["S_DQ_OPEN", "S_DQ_HIGH", "S_DQ_LOW", "S_DQ_CLOSE"]
-
-        for pre_col, adj_col in zip(pre_cols, adj_cols):
-            df.loc[:, adj_col] = round(df.loc[:, pre_col] * df.loc[:, "S_DQ_ADJFACTOR"], 1)
-        df = df[adj_cols]
-
-        return df
+        return adjust_prices(data)  # data only holds the contract
 
     def create_timedf(self, data):
         """Return the time data that contains the trading bars per day"""
@@ -74,12 +86,7 @@ class Config:
     
     def add_msi(self, msi, data):
         """Add daily msi column to dataframe"""
-        out = data.copy()
-        for date, today_msi in msi.iterrows():
-            date = date.date().isoformat()
-            out.loc[date, 'msi'] = float(today_msi)
-        
-        return out
+        return broadcast_daily(data, msi.iloc[:, 0], name='msi')
 
     def set_margin(self):
         # 保证金设置
@@ -103,7 +110,7 @@ class Config:
 metavar = Config()
 
 
-class DataInput(bt.feeds.PandasData):
+class DataInput(ArrayData):
 
     lines = ('msi',)
     params = (
@@ -172,6 +179,45 @@ class MyCommInfo(bt.CommInfoBase):
         return price * self.p.mult * self.p.margin
 
 
+class StreamingMSI(bt.Indicator):
+    """
+    Market sentiment index updated bar by bar within each day
+
+    The running max/min of the closes since the open give the drawdown
+    and rebound of the current bar, their running sums give the msi of
+    the bars seen so far. After `period` bars the value is frozen, it
+    then equals the daily msi of data.py without a prebuilt *_msi.csv.
+    """
+
+    lines = ('msi',)
+    params = (
+        ("period", 50),  # 平稳度观测区间
+    )
+
+    def __init__(self):
+        self._day = None
+
+    def next(self):
+        day = int(self.data.datetime[0])
+        price = self.data.close[0]
+
+        # 新交易日重置
+        if day != self._day:
+            self._day = day
+            self._count = 0
+            self._runmax = self._runmin = price
+            self._mdd = self._rev_mdd = 0.0
+
+        if self._count < self.p.period:
+            self._count += 1
+            self._runmax = max(self._runmax, price)
+            self._runmin = min(self._runmin, price)
+            self._mdd += (self._runmax - price) / self._runmax
+            self._rev_mdd += (price - self._runmin) / self._runmin
+
+        self.lines.msi[0] = min(self._mdd, self._rev_mdd) / self._count
+
+
 class MyStrats(bt.Strategy):
 
     params = (
@@ -179,13 +225,17 @@ class MyStrats(bt.Strategy):
         ("stop_limit", 0.005),
         ("msi_threshold", 9 / 10000),
         ("target_percent", 0.10),
+        ("stream_msi", False),  # 逐bar计算msi, 不使用预先生成的msi
     )
 
     def __init__(self):
         self.dataopen = self.datas[0].open
         self.dataclose = self.datas[0].close
         self.datadatetime = self.datas[0].datetime
-        self.datamsi = self.datas[0].msi
+        if self.p.stream_msi:
+            self.datamsi = StreamingMSI(self.datas[0], period=self.p.period).msi
+        else:
+            self.datamsi = self.datas[0].msi
 
         self.order = None
         self.open_price = None
@@ -261,7 +311,7 @@ class MyStrats(bt.Strategy):
         morning_open_time, morning_close_time, afternoon_open_time, afternoon_close_time = self.trade_time(date)
         self.morning_close_bar = self.trade_close_bar(date, self.morning_open_bar)
         self.afternoon_open_bar = self.morning_close_bar + 90 + 1  # 1.5h
-        self.afternoon_close_bar = self.trade_close_bar(date, self.afternoon_open_bar)
+        self.afternoon_close_bar = self.trade_close_bar(date, self.afternoon_open_bar, session=1)
 
         # 当日开盘价
         if time == morning_open_time:
@@ -314,33 +364,16 @@ class MyStrats(bt.Strategy):
         """Return today's trade times in terms of current date"""
         if not isinstance(date, datetime.date):
             raise Exception('Please use datetime object as date refernece')
-        
-        adj_date = datetime.date(2016, 1, 4)
-        if date < adj_date:
-            morning_open_time = datetime.time(9, 16)
-            morning_close_time = datetime.time(11, 30)
-            afternoon_open_time = datetime.time(13, 1)
-            afternoon_close_time = datetime.time(15, 15)
-        else:
-            morning_open_time = datetime.time(9, 31)
-            morning_close_time = datetime.time(11, 30)
-            afternoon_open_time = datetime.time(13, 1)
-            afternoon_close_time = datetime.time(15, 00)
-        
-        return (morning_open_time, morning_close_time, afternoon_open_time, afternoon_close_time)
-    
-    def trade_close_bar(self, date, open_bar):
+
+        return sessions.trade_times(date)
+
+    def trade_close_bar(self, date, open_bar, session=0):
         if not isinstance(date, datetime.date):
             raise Exception('Please use datetime object as date refernece')
-        
-        ref_date = datetime.date(2016, 1, 4)
-        if date < ref_date:
-            close_bar = open_bar + 135 - 1  # 2.25h
-        else:
-            close_bar = open_bar + 120 - 1  # 2h
-        
-        return close_bar
-    
+
+        # 2.25h before 2016-01-04, 2h afterwards
+        return open_bar + sessions.session_length(date, session) - 1
+
 
 def normal_analysis(strats):
     # =========== for analysis.py ============ #
@@ -430,14 +463,22 @@ def opt_analysis(results):
     print(opt_df)
 
 
-def run():
-    sys.stdout = Logger()
+def build_cerebro(lowmem=False, stream_msi=False):
+    """
+    Set up the backtest
 
+    lowmem=True bounds every line buffer to the indicator periods
+    (exactbars=1, see common/lowmem.py), `check_lowmem(build_cerebro)`
+    verifies that it trades exactly like the full run
+    """
     # Initialisation
-    cerebro = bt.Cerebro()
-    cerebro.addstrategy(MyStrats)
+    cerebro = bt.Cerebro(**cerebro_kwargs(lowmem))
+    cerebro.addstrategy(MyStrats, stream_msi=stream_msi)
 
-    data = DataInput(dataname=metavar.df)
+    if stream_msi:
+        data = DataInput(dataname=metavar.prices, msi=None)
+    else:
+        data = DataInput(dataname=metavar.df)
     cerebro.adddata(data)
 
     comminfo = MyCommInfo()
@@ -459,6 +500,14 @@ def run():
     cerebro.addobserver(bt.observers.DrawDown)
     cerebro.addobserver(bt.observers.TimeReturn)
 
+    return cerebro
+
+
+def run(lowmem=False, stream_msi=False):
+    sys.stdout = Logger()
+
+    cerebro = build_cerebro(lowmem, stream_msi)
+
     # Start backtesting
     print(f"开始资金总额 {cerebro.broker.getvalue():.2f}")
     results = cerebro.run()
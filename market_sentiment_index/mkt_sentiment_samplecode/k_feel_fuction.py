@@ -5,6 +5,7 @@
 
 
 import pandas as pd
+import numpy as np
 import empyrical as emp
 from matplotlib import pyplot as plt
 
@@ -20,60 +21,25 @@ plt.rcParams["axes.unicode_minus"] = False
 
 def cal_feel_stable(datas: list):
     """计算市场情绪的平稳度"""
-    aria_datas = datas
-    up_backs = []
-    down_backs = []
-    n = 0
-    for data in range(n, len(aria_datas)):
-        for data2 in range(n + 1, len(aria_datas)):
-            if aria_datas[data2] - aria_datas[data] != 0:
-                up = (aria_datas[data] - aria_datas[data2]) / aria_datas[data]
-                up_backs.append(up)
-                down = -(aria_datas[data] - aria_datas[data2]) / aria_datas[data]
-                down_backs.append(down)
-
-    # print('up_backs:', len(up_backs), up_backs)
-    # print('down_backs', len(down_backs), down_backs)
+    aria_datas = np.asarray(datas, dtype=np.float64)
+
+    # 所有价格不同的(data, data2)组合的回撤, data2从第二个bar开始, 按data逐行展开
+    diffs = aria_datas[:, None] - aria_datas[None, 1:]
+    changed = diffs != 0
+    bases = np.broadcast_to(aria_datas[:, None], diffs.shape)[changed]
+    if np.any(bases == 0):
+        # 与逐个相除时一样, 价格为0时报错
+        raise ZeroDivisionError("float division by zero")
+    up_backs = diffs[changed] / bases
+    down_backs = -up_backs
 
     # 求平均最大回撤
-    max_up_backs = []
-    for up_data in range(len(up_backs)):
-        if up_data + 1 == len(up_backs):
-            break
-        if up_backs[up_data] > 0 and up_backs[up_data + 1] < 0:
-            max_up_backs.append(up_backs[up_data])
-
-    # print('max_up_backs', max_up_backs)
+    max_up_backs = up_backs[:-1][(up_backs[:-1] > 0) & (up_backs[1:] < 0)].tolist()
     up_avg_back = sum(max_up_backs) / len(max_up_backs)
-    # print('up_avg_back', up_avg_back)
 
     # 求反向最大回撤
-    min_down_backs = []
-    for down_data in range(len(down_backs)):
-        if down_data + 1 == len(down_backs):
-            break
-        if down_backs[down_data] > 0 and down_backs[down_data + 1] < 0:
-            min_down_backs.append(down_backs[down_data])
-
-    # print('min_down_backs', min_down_backs)
+    min_down_backs = down_backs[:-1][(down_backs[:-1] > 0) & (down_backs[1:] < 0)].tolist()
     down_avg_back = sum(min_down_backs) / len(min_down_backs)
-    # print('down_avg_back', down_avg_back)
-
-    mdd, rev_mdd = [], []
-    for idx, p in enumerate(datas):
-        if idx + 1 == len(datas):
-            break
-        max_diff = p - min(datas[idx + 1:])
-        min_diff = p - max(datas[idx + 1:])
-        if max_diff != 0:
-            mdd_per_bar = max_diff / p
-            mdd.append(mdd_per_bar)
-        if min_diff != 0:
-            rev_mdd_per_bar = -min_diff / p
-            rev_mdd.append(rev_mdd_per_bar)
-        else:
-            continue
-    pass
 
     # 求今天情绪平稳度
     if up_avg_back - down_avg_back > 0:
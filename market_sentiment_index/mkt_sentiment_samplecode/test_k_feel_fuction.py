@@ -0,0 +1,142 @@
+# -*- coding: utf-8  -*-
+# Regression test of the vectorized cal_feel_stable against the original loops
+#
+# Run with: python -m pytest market_sentiment_index/mkt_sentiment_samplecode
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from k_feel_fuction import cal_feel_stable
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from common import datastore
+
+
+def cal_feel_stable_loop(datas: list):
+    """The original O(n^2) implementation of cal_feel_stable, kept as the reference"""
+    aria_datas = datas
+    up_backs = []
+    down_backs = []
+    n = 0
+    for data in range(n, len(aria_datas)):
+        for data2 in range(n + 1, len(aria_datas)):
+            if aria_datas[data2] - aria_datas[data] != 0:
+                up = (aria_datas[data] - aria_datas[data2]) / aria_datas[data]
+                up_backs.append(up)
+                down = -(aria_datas[data] - aria_datas[data2]) / aria_datas[data]
+                down_backs.append(down)
+
+    # 求平均最大回撤
+    max_up_backs = []
+    for up_data in range(len(up_backs)):
+        if up_data + 1 == len(up_backs):
+            break
+        if up_backs[up_data] > 0 and up_backs[up_data + 1] < 0:
+            max_up_backs.append(up_backs[up_data])
+
+    up_avg_back = sum(max_up_backs) / len(max_up_backs)
+
+    # 求反向最大回撤
+    min_down_backs = []
+    for down_data in range(len(down_backs)):
+        if down_data + 1 == len(down_backs):
+            break
+        if down_backs[down_data] > 0 and down_backs[down_data + 1] < 0:
+            min_down_backs.append(down_backs[down_data])
+
+    down_avg_back = sum(min_down_backs) / len(min_down_backs)
+
+    mdd, rev_mdd = [], []
+    for idx, p in enumerate(datas):
+        if idx + 1 == len(datas):
+            break
+        max_diff = p - min(datas[idx + 1:])
+        min_diff = p - max(datas[idx + 1:])
+        if max_diff != 0:
+            mdd_per_bar = max_diff / p
+            mdd.append(mdd_per_bar)
+        if min_diff != 0:
+            rev_mdd_per_bar = -min_diff / p
+            rev_mdd.append(rev_mdd_per_bar)
+        else:
+            continue
+    pass
+
+    # 求今天情绪平稳度
+    if up_avg_back - down_avg_back > 0:
+        feel_stable = down_avg_back
+    else:
+        feel_stable = up_avg_back
+
+    return feel_stable
+
+
+def outcome(func, datas):
+    """Return the result of func, or the type of the exception it raises"""
+    try:
+        return func(datas)
+    except ZeroDivisionError as e:
+        return type(e)
+
+
+def assert_same(datas):
+    expected = outcome(cal_feel_stable_loop, list(datas))
+    result = outcome(cal_feel_stable, list(datas))
+
+    if isinstance(expected, float) and np.isnan(expected):
+        assert np.isnan(result)
+    else:
+        # 逐位相同, 不是近似相等
+        assert result == expected
+
+
+def random_series():
+    rng = np.random.default_rng(2020)
+    for n in (2, 3, 5, 10, 50, 120):
+        for _ in range(20):
+            # 随机游走的价格
+            yield (4000 * np.exp(np.cumsum(rng.normal(0, 0.001, n)))).tolist()
+            # 最小变动价位的整数价格, 包含大量相等的价格
+            yield (3000 + rng.integers(-3, 4, n).cumsum()).tolist()
+
+
+@pytest.mark.parametrize("datas", list(random_series()))
+def test_random_series(datas):
+    assert_same(datas)
+
+
+@pytest.mark.parametrize(
+    "datas",
+    [
+        [],
+        [3000.0],
+        [3000.0] * 50,  # 价格不变, 没有回撤
+        [3000.0, 3000.2],
+        [3000.0, 3000.2, 3000.0],
+        [3000.0] * 25 + [3000.2] * 25,  # 单边上涨, 没有反向回撤
+        [0.0, 1.0, 2.0, 1.0],  # 价格为0
+        [1.0, 2.0, 0.0, 1.0],
+        [0.0] * 10,
+        [3000.0, 3001.0, float("nan"), 2999.0, 3000.0],
+    ],
+)
+def test_edge_cases(datas):
+    assert_same(datas)
+
+
+@pytest.mark.parametrize("contract", ["IF00", "IH00", "IC00"])
+def test_contract_days(contract):
+    """Every day of the contract, on the first 50 closes as in the sample strategy"""
+    if not (os.path.exists(datastore.DATA_PATH) or datastore.read_manifest()):
+        pytest.skip("data.csv is not available")
+
+    try:
+        closes = datastore.load(contract, columns=["S_DQ_CLOSE"])["S_DQ_CLOSE"]
+    except ValueError:
+        pytest.skip(f"no data of {contract}")
+
+    for _, day in closes.groupby(closes.index.date):
+        assert_same(day.iloc[0:50].tolist())
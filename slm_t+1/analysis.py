@@ -6,11 +6,10 @@ import matplotlib.ticker as mticker
 import matplotlib.dates as mdates
 import seaborn as sns
 
+import os
 import datetime
-from main import Config
-
-# initialise the global var
-metavar = Config()
+from main import metavar  # frames are built lazily and shared with main
+from common.sweep import load_results
 
 # initialise pyplot settings
 plt.rcParams["axes.unicode_minus"] = False  # display minus sign correctly
@@ -322,9 +321,12 @@ class Microscope:
         """
         plt.style.use('seaborn')
 
+        # optimise() 的结果以参数名 lookback_period 为列名
+        x = 'period' if 'period' in df else 'lookback_period'
+
         fig, ax = plt.subplots(figsize=self.figsize)
         df.plot(
-                kind='bar', x='period', y=['ann_rets', 'max_drawdown'],
+                kind='bar', x=x, y=['ann_rets', 'max_drawdown'],
                 ax=ax, rot=0, title='Performance for Different Lookback Period'
                 )
 
@@ -339,6 +341,7 @@ class Microscope:
 if __name__ == '__main__':
     rets_file = "./results/timereturn.csv"
     opt_results_path = "./results/opt_results.csv"
+    opt_sweep_path = "./results/opt_sweep.csv"  # optimise() 的结果, 回测未完成时也可读取
 
     rets_df = pd.read_csv(rets_file)
     rets_df = rets_df.rename(columns={'Unnamed: 0': 'Date', '0': 'timereturn'})
@@ -346,7 +349,11 @@ if __name__ == '__main__':
     rets_df.index = pd.to_datetime(rets_df.index)
     prices_df = metavar.test_df.loc[metavar.fromdate:metavar.todate]
 
-    opt_df = pd.read_csv(opt_results_path)  # 参数寻优
+    # 参数寻优
+    if os.path.exists(opt_sweep_path):
+        opt_df = load_results(opt_sweep_path)
+    else:
+        opt_df = pd.read_csv(opt_results_path)
 
     ind = Microscope(rets_df, prices_df, opt_df)
     
@@ -0,0 +1,572 @@
+# -*- coding: UTF-8 -*-
+# Integer encoded n-grams of the SLM patterns
+#
+# The symbols of the `pat` column are 1..m, by default m = 2 with 1 for a
+# falling and 2 for a rising day. An n-gram of symbols is encoded as an
+# n-digit base-m integer with the oldest symbol as the most significant
+# digit, e.g. [2, 1, 2] -> 0b101 = 5 for m = 2. The n-gram counts of the
+# corpus then fit in an array of m**n entries indexed by the code, and the
+# code of the last n symbols is updated in O(1) per bar by shifting in the
+# newest symbol. Orders of more than DENSE_SIZE codes, e.g. long patterns
+# of a quantile alphabet, only store the codes seen in a SparseTable.
+
+import numpy as np
+
+import os
+import sys
+import hashlib
+
+sys.path.append(os.path.abspath(".."))
+from common import datastore
+
+# 模型缓存目录
+CACHE_PATH = os.path.join(datastore.STORE_PATH, "slm")
+
+# 默认统计的最高阶数, 覆盖 lookback_period 的寻优区间
+DEFAULT_ORDER = 10
+
+# 已载入的模型, 以语料库哈希、符号数和阶数为键
+_models = {}
+
+# 编码数不超过该值的阶使用数组计数, 否则只保存出现过的编码
+DENSE_SIZE = 1 << 20
+
+
+def symbolize(ret, edges):
+    """
+    Return the symbols of returns split at ascending edges
+
+    A return r gets the symbol 1 + the number of edges below r, e.g. the
+    edges [0] give the up/down alphabet 1 for r <= 0 and 2 for r > 0, and
+    [-band, band] add the flat symbol 2 for -band < r <= band. nan returns
+    get the last symbol.
+
+    Params
+    ------
+    - ret:
+        array-like of returns
+    - edges:
+        ascending returns between the symbols, m - 1 edges for m symbols
+
+    Returns
+    -------
+    - pats: np.ndarray
+        int64 array of symbols 1..len(edges) + 1
+    """
+    return np.searchsorted(np.asarray(edges, dtype=np.float64), ret, side="left") + 1
+
+
+def quantile_edges(ret, m):
+    """Return the edges splitting the returns into m equally frequent symbols"""
+    return np.nanquantile(np.asarray(ret, dtype=np.float64), np.arange(1, m) / m)
+
+
+def updown_probs(probs):
+    """
+    Return the probabilities (up, down) of the next symbol
+
+    The symbols are ordered by return, so the upper m // 2 symbols count
+    as up and the lower m // 2 as down. For odd m the middle symbol, e.g.
+    flat of a 3-symbol alphabet or the median quantile, counts as neither:
+    up + down is 1 minus its probability, and a next day most likely flat
+    only signals through the probabilities of the other symbols.
+
+    Params
+    ------
+    - probs:
+        probabilities of the symbols 1..m following the current pattern
+
+    Returns
+    -------
+    - (up_prob, down_prob)
+    """
+    m = len(probs)
+
+    return sum(probs[m - m // 2:]), sum(probs[:m // 2])
+
+
+def ngram_codes(pats, n, m=2):
+    """
+    Return the codes of all n-grams of a symbol series
+
+    Params
+    ------
+    - pats:
+        array-like of symbols 1..m, oldest first
+    - n:
+        order of the n-grams
+    - m:
+        number of symbols of the alphabet
+
+    Returns
+    -------
+    - codes: np.ndarray
+        int64 array of len(pats) - n + 1 codes
+    """
+    digits = np.asarray(pats, dtype=np.int64) - 1
+    if len(digits) < n:
+        return np.empty(0, dtype=np.int64)
+
+    weights = m ** np.arange(n - 1, -1, -1, dtype=np.int64)
+    return np.lib.stride_tricks.sliding_window_view(digits, n) @ weights
+
+
+def ngram_table(pats, n, m=2):
+    """
+    Return the probability of every n-gram in the corpus
+
+    Params
+    ------
+    - pats:
+        array-like of symbols 1..m, oldest first
+    - n:
+        order of the n-grams
+    - m:
+        number of symbols of the alphabet
+
+    Returns
+    -------
+    - table: np.ndarray
+        float64 array of m**n probabilities indexed by the n-gram code,
+        n-grams missing in the corpus have probability 0
+    """
+    codes = ngram_codes(pats, n, m)
+    counts = np.bincount(codes, minlength=m ** n)
+
+    return counts / max(len(codes), 1)
+
+
+def roll(code, symbol, n, m=2):
+    """Return the code of the last n symbols after appending a symbol"""
+    return (code * m + int(symbol) - 1) % m ** n
+
+
+def corpus_hash(pats):
+    """Return the sha1 hex digest of a symbol corpus"""
+    bits = np.ascontiguousarray(np.asarray(pats, dtype=np.int64))
+    return hashlib.sha1(bits.tobytes()).hexdigest()[:12]
+
+
+class SparseTable(dict):
+    """
+    code -> value of the n-grams seen in the corpus
+
+    Stands in for the array of an order whose m**n codes do not fit in
+    memory. The lookup of a missing code returns 0, or with `lower` the
+    value of the lower order table at the code of the newest n - 1 symbols,
+    without storing it.
+
+    Params
+    ------
+    - size:
+        number of codes of the order, m**n
+    - items:
+        code -> value pairs
+    - lower:
+        table the missing codes back off to
+    """
+
+    def __init__(self, size, items=(), lower=None):
+        super().__init__(items)
+        self.size = size
+        self.lower = lower
+
+    def __missing__(self, code):
+        if self.lower is None:
+            return 0
+        return self.lower[code % self.lower.size]
+
+    def sum(self):
+        return sum(self.values())
+
+
+def entries(table):
+    """Return the codes and values of the nonzero entries of a table"""
+    if isinstance(table, SparseTable):
+        codes = np.fromiter(table.keys(), dtype=np.int64, count=len(table))
+        values = np.array(list(table.values()))
+        keep = values > 0
+        return codes[keep], values[keep]
+
+    codes = np.flatnonzero(table)
+    return codes, table[codes]
+
+
+def lookup(table, codes):
+    """Return the values of a table at an array of codes"""
+    if isinstance(table, SparseTable):
+        return np.array([table[code] for code in codes.tolist()], dtype=np.float64)
+    return table[codes]
+
+
+def tally(codes, size, weights=None):
+    """
+    Return the counts of the codes, or the sums of their weights, as an
+    array of `size` entries or a SparseTable if size > DENSE_SIZE
+    """
+    if size <= DENSE_SIZE:
+        counts = np.bincount(codes, weights, minlength=size)
+    else:
+        keys, inverse = np.unique(codes, return_inverse=True)
+        counts = np.bincount(inverse, weights)
+
+    if weights is not None:
+        counts = counts.astype(np.asarray(weights).dtype)
+    if size <= DENSE_SIZE:
+        return counts
+
+    return SparseTable(size, zip(keys.tolist(), counts.tolist()))
+
+
+def prefix_counts(count, m):
+    """Return the summed counts of the n-grams sharing their first n - 1 symbols"""
+    if isinstance(count, SparseTable):
+        codes, values = entries(count)
+        return tally(codes // m, count.size // m, values)
+
+    return count.reshape(-1, m).sum(axis=1)
+
+
+def discount(count):
+    """Return the absolute discount n1 / (n1 + 2 * n2) of counts, 0.75 if undefined"""
+    rounded = np.rint(entries(count)[1])
+    n1 = np.count_nonzero(rounded == 1)
+    n2 = np.count_nonzero(rounded == 2)
+
+    return n1 / (n1 + 2 * n2) if n1 and n2 else 0.75
+
+
+def kneser_ney(count, lower, m=2):
+    """
+    Return the interpolated Kneser-Ney probabilities of one order
+
+    Params
+    ------
+    - count:
+        counts of the k-grams indexed by the code
+    - lower:
+        smoothed probabilities of the (k-1)-grams, the k-gram of code c
+        backs off to the (k-1)-gram of its newest symbols c % lower.size
+    - m:
+        number of symbols of the alphabet
+
+    Returns
+    -------
+    - table:
+        array of the probabilities, or for a sparse order a SparseTable
+        of the seen contexts backing off to `lower` for the others
+    """
+    d = discount(count)
+
+    if isinstance(count, SparseTable):
+        # 只计算出现过的上下文, 其余编码查询时回退到低阶
+        codes, values = entries(count)
+        contexts, inverse = np.unique(codes // m, return_inverse=True)
+        full = (contexts[:, None] * m + np.arange(m)).ravel()
+        pairs = np.zeros(len(full))
+        pairs[inverse * m + codes % m] = values
+
+        total = np.repeat(np.bincount(inverse, values), m)
+        types = np.repeat(np.bincount(inverse), m)
+        prob = np.maximum(pairs - d, 0) / total + d * types / total * lookup(lower, full % lower.size)
+
+        return SparseTable(count.size, zip(full.tolist(), prob.tolist()), lower=lower)
+
+    pairs = count.reshape(-1, m).astype(np.float64)
+    context = pairs.sum(axis=1, keepdims=True)
+    types = (pairs > 0).sum(axis=1, keepdims=True)
+
+    backoff = np.tile(lower, count.size // lower.size).reshape(-1, m)
+    seen = context > 0
+    total = np.where(seen, context, 1.0)
+    prob = np.maximum(pairs - d, 0) / total + d * types / total * backoff
+
+    return np.where(seen, prob, backoff).ravel()
+
+
+class SLMModel:
+    """
+    Counts of the n-grams of every order 1..N of a symbol corpus
+
+    Only the N-grams are counted in a scan of the corpus. The k-gram
+    counts follow by summing the counts of the (k+1)-grams which extend
+    each k-gram, i.e. runs of m adjacent codes, plus the last k-gram of
+    the corpus which no (k+1)-gram extends. Probability tables of any
+    order are derived from the counts on first use.
+
+    Params
+    ------
+    - counts:
+        list of the count tables of the orders 1..N, counts[k - 1] holds
+        the counts of the k-grams indexed by the code, an int64 array of
+        m**k entries or a SparseTable
+    - m:
+        number of symbols of the alphabet
+    """
+
+    def __init__(self, counts, m=2):
+        self.counts = [c if isinstance(c, SparseTable) else np.asarray(c) for c in counts]
+        self.m = m
+        self._joint = {}
+        self._conditional = {}
+        self._smoothed = {}
+
+    @property
+    def order(self):
+        return len(self.counts)
+
+    @classmethod
+    def fit(cls, pats, order=DEFAULT_ORDER, m=2):
+        """Count the n-grams of orders 1..order of a corpus of symbols 1..m"""
+        pats = np.asarray(pats, dtype=np.int64)
+        if len(pats) and (pats.min() < 1 or pats.max() > m):
+            raise ValueError(f"Symbols must be 1..{m}")
+
+        counts = [tally(ngram_codes(pats, order, m), m ** order)]
+
+        for k in range(order - 1, 0, -1):
+            count = prefix_counts(counts[0], m)
+            if len(pats) >= k:
+                # 语料库最后的k-gram
+                count[int(ngram_codes(pats[-k:], k, m)[0])] += 1
+            counts.insert(0, count)
+
+        return cls(counts, m)
+
+    def count(self, n):
+        """Return the counts of the n-grams"""
+        return self.counts[n - 1]
+
+    def joint(self, n):
+        """Return the probability of every n-gram in the corpus, see `ngram_table`"""
+        if n not in self._joint:
+            count = self.count(n)
+            total = count.sum() or 1
+            if isinstance(count, SparseTable):
+                self._joint[n] = SparseTable(count.size, ((code, c / total) for code, c in count.items()))
+            else:
+                self._joint[n] = count / total
+
+        return self._joint[n]
+
+    def conditional(self, n):
+        """
+        Return the probability of the last symbol of every n-gram given
+        its first n - 1 symbols, 0 for contexts missing in the corpus
+        """
+        if n not in self._conditional:
+            count, m = self.count(n), self.m
+            if isinstance(count, SparseTable):
+                context = prefix_counts(count, m)
+                self._conditional[n] = SparseTable(
+                        count.size, ((code, c / context[code // m]) for code, c in count.items() if c)
+                        )
+            else:
+                count = count.reshape(-1, m)
+                context = count.sum(axis=1, keepdims=True)
+                out = np.zeros(count.shape)
+                self._conditional[n] = np.divide(count, context, out=out, where=context > 0).ravel()
+
+        return self._conditional[n]
+
+    def prob(self, code, n):
+        """Return the probability of the n-gram of the code"""
+        return self.joint(n)[code]
+
+    def continuation(self, k):
+        """
+        Return the number of distinct symbols preceding every k-gram,
+        the Kneser-Ney counts of the lower orders
+        """
+        count = self.count(k + 1)
+        size = count.size // self.m
+        if isinstance(count, SparseTable):
+            return tally(entries(count)[0] % size, size)
+
+        return (count.reshape(self.m, -1) > 0).sum(axis=0)
+
+    def smoothed(self, n):
+        """
+        Return the interpolated Kneser-Ney probability of the last symbol
+        of every n-gram given its first n - 1 symbols
+
+        Each order discounts its counts by D and gives the discounted mass
+        to the next lower order, which drops the oldest symbol and counts
+        the distinct symbols preceding a pattern instead of its
+        occurrences. Order 1 backs off to the uniform distribution and
+        unseen contexts take the lower order as is, so every n-gram up to
+        the model order gets a probability. D is the estimate
+        n1 / (n1 + 2 * n2) of the counts of each order.
+
+        Returns
+        -------
+        - table:
+            float64 array of m**n probabilities indexed by the n-gram code,
+            for a sparse order a SparseTable looking up the unseen
+            contexts in the lower orders
+        """
+        if n not in self._smoothed:
+            lower = np.full(1, 1.0 / self.m)
+            for k in range(1, n + 1):
+                count = self.count(k) if k == n else self.continuation(k)
+                lower = kneser_ney(count, lower, self.m)
+            self._smoothed[n] = lower
+
+        return self._smoothed[n]
+
+    def smoothed_prob(self, code, n):
+        """Return the smoothed probability of the last symbol of the n-gram of the code"""
+        return self.smoothed(n)[code]
+
+    def save(self, path):
+        arrays = {"alphabet": np.array(self.m)}
+        for i, count in enumerate(self.counts):
+            if isinstance(count, SparseTable):
+                arrays[f"codes_{i}"], arrays[f"values_{i}"] = entries(count)
+            else:
+                arrays[f"arr_{i}"] = count
+
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as npz:
+            m = int(npz["alphabet"]) if "alphabet" in npz.files else 2
+            counts = []
+            while True:
+                i = len(counts)
+                if f"arr_{i}" in npz.files:
+                    counts.append(npz[f"arr_{i}"])
+                elif f"codes_{i}" in npz.files:
+                    items = zip(npz[f"codes_{i}"].tolist(), npz[f"values_{i}"].tolist())
+                    counts.append(SparseTable(m ** (i + 1), items))
+                else:
+                    break
+
+        return cls(counts, m)
+
+
+def as_float(count):
+    """Return a float64 copy of a count table"""
+    if isinstance(count, SparseTable):
+        return SparseTable(count.size, ((code, float(c)) for code, c in count.items()))
+
+    return np.array(count, dtype=np.float64)
+
+
+class OnlineSLM(SLMModel):
+    """
+    SLMModel learning from every new symbol, for walk-forward backtests
+
+    `update` adds the n-grams ending at the new symbol, one count per
+    order, so each bar costs O(N) whatever the corpus size. With decay < 1
+    the counts of older symbols shrink by `decay` per update: instead of
+    rescaling the whole tables, the weight of new counts grows by 1/decay
+    per update and the probabilities, being ratios of counts, are
+    unchanged. The tables are renormalised only when the weight gets large.
+    Derived tables, e.g. `smoothed`, are rebuilt by the first lookup after
+    an update, which costs a pass over the counts of the order per bar.
+    They are built from the counts divided by the weight, i.e. the decayed
+    counts, as the Kneser-Ney discount depends on the scale of the counts.
+
+    Params
+    ------
+    - counts:
+        initial counts of the orders 1..N, e.g. `SLMModel.counts`
+    - decay:
+        factor applied to all counts per update, 1.0 keeps every count
+    - m:
+        number of symbols of the alphabet
+    """
+
+    # 新计数的权重超过该值时统一缩放
+    MAX_WEIGHT = 1e100
+
+    def __init__(self, counts, decay=1.0, m=2):
+        super().__init__([as_float(c) for c in counts], m)
+        self.decay = decay
+        self.totals = np.array([c.sum() for c in self.counts])
+        self.weight = 1.0
+
+        # 已加入的最近N个符号
+        self.code = 0
+        self.seen = 0
+
+    @classmethod
+    def from_model(cls, model, decay=1.0):
+        """Return an online copy of a fitted model"""
+        return cls(model.counts, decay, model.m)
+
+    def update(self, symbol):
+        """Add the n-grams of all orders ending at the new symbol"""
+        self.code = roll(self.code, symbol, self.order, self.m)
+        self.seen = min(self.seen + 1, self.order)
+
+        if self.decay != 1.0:
+            self.weight /= self.decay
+            if self.weight > self.MAX_WEIGHT:
+                for count in self.counts:
+                    if isinstance(count, SparseTable):
+                        for code in count:
+                            count[code] /= self.weight
+                    else:
+                        count /= self.weight
+                self.totals /= self.weight
+                self.weight = 1.0
+
+        # k阶n-gram的编码为最近k个符号, 即编码的低k位
+        for count in self.counts[:self.seen]:
+            count[self.code % count.size] += self.weight
+        self.totals[:self.seen] += self.weight
+
+        # 概率表在下次查询时按新计数重算
+        self._joint.clear()
+        self._conditional.clear()
+        self._smoothed.clear()
+
+    def count(self, n):
+        """Return the decayed counts of the n-grams, the newest one counting 1"""
+        count = self.counts[n - 1]
+        if self.weight == 1.0:
+            return count
+
+        if isinstance(count, SparseTable):
+            return SparseTable(count.size, ((code, c / self.weight) for code, c in count.items()))
+        return count / self.weight
+
+    def prob(self, code, n):
+        return self.counts[n - 1][code] / max(self.totals[n - 1], 1e-300)
+
+
+def load_model(pats, order=DEFAULT_ORDER, m=2, folder=CACHE_PATH):
+    """
+    Return the SLMModel of a corpus, counted once and cached on disk
+
+    Params
+    ------
+    - pats:
+        array-like of symbols 1..m, oldest first
+    - order:
+        highest order of the model
+    - m:
+        number of symbols of the alphabet
+    - folder:
+        cache directory of the counts, files are keyed by corpus hash
+
+    Returns
+    -------
+    - model: SLMModel
+    """
+    pats = np.asarray(pats, dtype=np.int64)
+    key = f"{corpus_hash(pats)}_{m}_{order}"
+
+    if key not in _models:
+        path = os.path.join(folder, f"{key}.npz")
+        if os.path.exists(path):
+            _models[key] = SLMModel.load(path)
+        else:
+            _models[key] = SLMModel.fit(pats, order, m)
+            os.makedirs(folder, exist_ok=True)
+            _models[key].save(path)
+
+    return _models[key]
@@ -13,22 +13,17 @@ import empyrical as emp
 import os, sys
 import datetime
 
+import slm
 
-class Config:
+sys.path.append(os.path.abspath(".."))
+from common.bars import load_bars
+from common.feeds import ArrayData
+from common.lazy import lazyframe
+from common.lowmem import Lookback, cerebro_kwargs
+from common.sweep import sweep
 
-    # 三大指数
-    train_data = pd.read_csv(
-            os.path.abspath('../index.csv'),
-            index_col='TRADE_DT',
-            parse_dates=True
-            )
 
-    # 股指期货主力合约
-    test_data = pd.read_csv(
-            os.path.abspath('../data.csv'),
-            index_col='TRADE_DT',
-            parse_dates=True
-            )
+class Config:
 
     contract = 'IF00'
     benchmark = 300
@@ -43,63 +38,88 @@ class Config:
     commission = 0.23 / 10000
     stamp_duty = 0.001
 
+    # 符号表: "updown" 跌1/涨2, "flat" 跌1/平2/涨3,
+    # "quantile" 按训练集收益率的等分位数分为 quantiles 个符号
+    alphabet = 'updown'
+    flat_band = 0.002  # flat 平盘的收益率区间 (-flat_band, flat_band]
+    quantiles = 4
+
+    @property
+    def symbols(self):
+        """Number of symbols m of the alphabet"""
+        return {'updown': 2, 'flat': 3}.get(self.alphabet, self.quantiles)
+
+    def pattern_edges(self):
+        """Return the returns between adjacent symbols of the alphabet"""
+        if self.alphabet == 'updown':
+            return [0.0]
+        if self.alphabet == 'flat':
+            return [-self.flat_band, self.flat_band]
+        if self.alphabet == 'quantile':
+            # 分位数只取自训练集, 不使用测试期的数据
+            close = self.train_data.loc[self.train_fromdate:self.train_todate, 'S_DQ_CLOSE']
+            return slm.quantile_edges(close.pct_change(), self.quantiles)
+
+        raise ValueError(f"Unknown alphabet {self.alphabet}")
+
+
+    # lazyframe 的缓存键: 各帧所依赖的属性
+    memo_attrs = (
+            'contract', 'benchmark', 'train_fromdate', 'train_todate', 'fromdate', 'todate',
+            'alphabet', 'flat_band', 'quantiles',
+            )
 
-    def __init__(self):
-        # 历史数据始料库
+    @lazyframe
+    def index_data(self):
+        # 三大指数
+        return pd.read_csv(
+                os.path.abspath('../index.csv'),
+                index_col='TRADE_DT',
+                parse_dates=True
+                )
+
+    @lazyframe
+    def train_data(self):
         cols = ['S_DQ_OPEN', 'S_DQ_HIGH', 'S_DQ_LOW', 'S_DQ_CLOSE']
-        self.train_data = self.train_data[self.train_data['S_INFO_CODE'] == self.benchmark][cols]
-        self.train_df = self.create_pattern(
+        return self.index_data[self.index_data['S_INFO_CODE'] == self.benchmark][cols]
+
+    @lazyframe
+    def train_df(self):
+        # 历史数据始料库
+        return self.create_pattern(
                 self.train_data, ref_col='S_DQ_CLOSE',
                 fromdate=None, todate=self.train_todate
                 )
 
-        self.resampled_data = self.resample_df(
-                self.cal_adjprices(self.test_data, self.contract),
-                'daily'
-                )
-        self.resampled_data = self.create_pattern(self.resampled_data, ref_col='S_DQ_ADJCLOSE')
-        self.test_df = self.resampled_data.loc[self.fromdate:self.todate]
+    @lazyframe
+    def resampled_data(self):
+        # 股指期货主力合约
+        df = self.resample_df(self.contract, 'daily')
+        return self.create_pattern(df, ref_col='S_DQ_ADJCLOSE')
+
+    @lazyframe
+    def test_df(self):
+        return self.resampled_data.loc[self.fromdate:self.todate]
 
     def create_pattern(self, df: pd.DataFrame, ref_col: str, fromdate=None, todate=None):
-        """Numerical pattern 1 for price goes down, 2 for price goes up"""
+        """Numerical pattern 1..m of the alphabet, by default 1 for price goes down, 2 for price goes up"""
 
         fromdate = fromdate or datetime.date(2004, 4, 16) 
         todate =todate or datetime.date(2021, 12, 21) 
 
         df = df.loc[fromdate:todate]
         df['ret'] = df[ref_col].pct_change()
-        df['pat'] = df['ret'].apply(lambda x: 1 if x <= 0 else 2) 
+        df['pat'] = slm.symbolize(df['ret'], self.pattern_edges())
         df = df.dropna()
 
         return df
 
-    def cal_adjprices(self, df: pd.DataFrame, contract: str):
-        """Calculate the adjusted prices for specific contract"""
+    def resample_df(self, contract: str, freq: str):
+        """Return the adjusted bars of the contract, read from the bar cache"""
 
-        df = df[df["S_INFO_CODE"] == contract]
-        adj_cols = ["S_DQ_ADJOPEN","S_DQ_ADJHIGH","S_DQ_ADJLOW","S_DQ_ADJCLOSE",]
-        pre_cols = ["S_DQ_OPEN", "S_DQ_HIGH", "S_DQ_LOW", "S_DQ_CLOSE"]
+        rules = {"weekly": "W-MON", "daily": "D"}
 
-        for pre_col, adj_col in zip(pre_cols, adj_cols):
-            df.loc[:, adj_col] = round(
-                df.loc[:, pre_col] * df.loc[:, "S_DQ_ADJFACTOR"], 1
-            )
-
-        return df[adj_cols]
-
-    def resample_df(self, df: pd.DataFrame, freq: str):
-        """Resample the dataframe to specific frequency"""
-
-        adj_cols = ["S_DQ_ADJOPEN","S_DQ_ADJHIGH","S_DQ_ADJLOW","S_DQ_ADJCLOSE",]
-        methods = ['first', 'max', 'min', 'last']
-        agg_dict = {col:method for col, method in zip(adj_cols, methods)}
-
-        if freq == "weekly":
-            df = df.resample("W-MON").agg(agg_dict).dropna()
-        elif freq == "daily":
-            df = df.resample("D").agg(agg_dict).dropna()
-
-        return df
+        return load_bars(contract, rules[freq])
 
 
 metavar = Config()
@@ -120,7 +140,7 @@ class Logger:
         pass
 
 
-class DataInput(bt.feeds.PandasData):
+class DataInput(ArrayData):
     lines = ("pattern",)  # extending the datafeed
     params = (
         ("nullvalue", np.nan),
@@ -178,7 +198,7 @@ class MyCommInfo(bt.CommInfoBase):
         return price * self.p.mult * self.p.margin
 
 
-class MyStrats(bt.Strategy):
+class MyStrats(Lookback, bt.Strategy):
     
     params = (
         ("printout", True),
@@ -186,6 +206,9 @@ class MyStrats(bt.Strategy):
         ("theta", 0.01),
         ("mult", metavar.mult),
         ("lookback_period", 6),
+        ("walkforward", False),  # 回测期间逐bar更新n-gram计数
+        ("decay", 1.0),  # walkforward时每个bar旧计数的衰减系数
+        ("smoothing", False),  # Kneser-Ney平滑, 未出现过的模式也有概率
     )
 
     def __init__(self):
@@ -205,8 +228,16 @@ class MyStrats(bt.Strategy):
         self.atr = bt.ind.ATR(self.datas[0], period=14)
         
         # get patterns of history data
-        self.train_pat = self.get_patterns(metavar.train_df, self.p.lookback_period)
-        self.pat = []
+        self.model = self.get_model(metavar.train_df, self.p.lookback_period)
+        if self.p.walkforward:
+            self.model = slm.OnlineSLM.from_model(self.model, self.p.decay)
+        # 平滑时比较条件概率, 与比较联合概率等价
+        self.prob = self.model.smoothed_prob if self.p.smoothing else self.model.prob
+        self.code = 0  # 过去n-1天符号的编码
+
+    def lookback(self):
+        # next() 读取前一个bar的收盘价
+        return 2
 
     def log(self, txt, dt=None):
         dt = dt or self.datadatetime.date(0)
@@ -280,7 +311,18 @@ class MyStrats(bt.Strategy):
     def start(self):
         pass
 
+    def prenext(self):
+        self.roll_code()
+
+    def roll_code(self):
+        # 每个bar移入当天的符号
+        self.code = slm.roll(self.code, self.datapat[0], self.p.lookback_period - 1, self.model.m)
+        if self.p.walkforward:
+            self.model.update(self.datapat[0])
+
     def next(self):
+        self.roll_code()
+
         bypass_conds = [
                 self.order,
                 len(self) < self.p.lookback_period,
@@ -289,17 +331,12 @@ class MyStrats(bt.Strategy):
             return
 
         now = bt.num2date(self.datadatetime[0]).date()
-        
-        self.pat = np.array(
-                self.datapat.get(ago=0, size=self.p.lookback_period - 1),
-                dtype=int
-                )  # 过去n-1天的符号
-
-        up_pat = np.array2string(np.append(self.pat, 2), separator=',')
-        down_pat = np.array2string(np.append(self.pat, 1), separator=',')
 
-        self.up_prob = self.train_pat[up_pat] / sum(self.train_pat)
-        self.down_prob = self.train_pat[down_pat] / sum(self.train_pat)
+        # 过去n-1天的符号之后为上涨或下跌的概率, 即后一半或前一半符号的概率之和
+        # m为奇数时中间的符号不计入两者, 见 slm.updown_probs
+        m = self.model.m
+        probs = [self.prob(self.code * m + s, self.p.lookback_period) for s in range(m)]
+        self.up_prob, self.down_prob = slm.updown_probs(probs)
 
         upsig = self.up_prob >= self.down_prob
         downsig = self.up_prob < self.down_prob
@@ -360,17 +397,15 @@ class MyStrats(bt.Strategy):
         
         return size
 
-    def get_patterns(self, df: pd.DataFrame, n: int):
-        """
-        Return a pd.Series that contains all
-        patterns with specific n days look back
+    def get_model(self, df: pd.DataFrame, n: int):
         """
+        Return the SLM model of the patterns, which serves the
+        probabilities of all patterns with up to n days look back
 
-        pat_list = [df['pat'].iloc[i:i + n].values for i in range(len(df) - n + 1)]
-        pat_list = [np.array2string(pat, separator=',') for pat in pat_list]
-        pat = pd.Series(pat_list).value_counts()
-
-        return pat
+        The counts of all orders are built once per corpus and cached,
+        so strategies of different lookback periods share them
+        """
+        return slm.load_model(df['pat'].to_numpy(), max(n, slm.DEFAULT_ORDER), metavar.symbols)
 
 
 def normal_analysis(strats):
@@ -430,25 +465,33 @@ def normal_analysis(strats):
     perf_df.to_csv('./results/perf_df.csv')
 
 
+def opt_metrics(result):
+    """Performance metrics of one run of the optimisation"""
+    analysers = {}
+
+    # 返回参数
+    rets = pd.Series(result.analyzers._TimeReturn.get_analysis())
+    
+    # 夏普比率
+    max_drawdown = emp.max_drawdown(rets)
+    ann_rets = emp.annual_return(rets, period='daily')
+    calmar = ann_rets / -max_drawdown
+    sharpe = emp.sharpe_ratio(rets, risk_free=0, period='daily')
+    
+    analysers['ann_rets'] = ann_rets
+    analysers['max_drawdown'] = max_drawdown
+    analysers['calmar_ratio'] = calmar
+    analysers['sharpe'] = sharpe
+
+    return analysers
+
+
 def opt_analysis(results):
 
     def get_analysis(result):
         analysers = {}
         analysers['period'] = result.params.lookback_period
-
-        # 返回参数
-        rets = pd.Series(result.analyzers._TimeReturn.get_analysis())
-        
-        # 夏普比率
-        max_drawdown = emp.max_drawdown(rets)
-        ann_rets = emp.annual_return(rets, period='daily')
-        calmar = ann_rets / -max_drawdown
-        sharpe = emp.sharpe_ratio(rets, risk_free=0, period='daily')
-        
-        analysers['ann_rets'] = ann_rets
-        analysers['max_drawdown'] = max_drawdown
-        analysers['calmar_ratio'] = calmar
-        analysers['sharpe'] = sharpe
+        analysers.update(opt_metrics(result))
 
         return analysers
 
@@ -459,20 +502,29 @@ def opt_analysis(results):
     print(opt_df)
 
 
-def run():
-    sys.stdout = Logger()
+def build_cerebro(lowmem=False, frames=None, **params):
+    """
+    Set up the backtest
+
+    lowmem=True bounds every line buffer to the lookback period
+    (exactbars=1, see common/lowmem.py), `check_lowmem(build_cerebro)`
+    verifies that it trades exactly like the full run. frames holds the
+    "test" and "train" bars, default those of metavar, params are passed
+    to the strategy.
+    """
+    frames = frames or {"test": metavar.test_df, "train": metavar.train_df}
 
     # Initialisation
     # normal init
-    cerebro = bt.Cerebro()
-    cerebro.addstrategy(MyStrats)
+    cerebro = bt.Cerebro(**cerebro_kwargs(lowmem))
+    cerebro.addstrategy(MyStrats, **params)
 
-    # optimisation init
+    # optimisation init, see optimise()
     # cerebro = bt.Cerebro(optdatas=True, optreturn=True)
     # cerebro.optstrategy(MyStrats, lookback_period=range(3, 9))
 
-    data0 = DataInput(dataname=metavar.test_df)
-    data1 = DataInput(dataname=metavar.train_df)
+    data0 = DataInput(dataname=frames["test"])
+    data1 = DataInput(dataname=frames["train"])
     cerebro.adddata(data0)
     # cerebro.adddata(data1)
 
@@ -486,6 +538,14 @@ def run():
     cerebro.addanalyzer(bt.analyzers.TimeReturn, _name="_TimeReturn")
     cerebro.addanalyzer(bt.analyzers.PyFolio, _name="pyfolio")
 
+    return cerebro
+
+
+def run(lowmem=False):
+    sys.stdout = Logger()
+
+    cerebro = build_cerebro(lowmem)
+
     # Backtesting
     print(f"开始资金总额 {cerebro.broker.getvalue():.2f}")
     results = cerebro.run()
@@ -500,8 +560,22 @@ def run():
     # opt_analysis(results)
 
 
+def optimise(processes=None):
+    """Run the lookback period optimisation in parallel, see common/sweep.py"""
+    # 在创建进程池前生成, 策略中读取的 metavar.train_df 由各进程继承
+    frames = {"test": metavar.test_df, "train": metavar.train_df}
+    grid = dict(lookback_period=range(3, 9))
+
+    # 可中断后重新运行, 已完成的参数组合不再回测
+    opt_df = sweep(build_cerebro, grid, opt_metrics, frames, './results/opt_sweep.csv', processes)
+    print(opt_df)
+
+    return opt_df
+
+
 if __name__ == "__main__":
     run()
+    # optimise()
     # print(metavar.test_df)
 
 
@@ -0,0 +1,246 @@
+# -*- coding: UTF-8 -*-
+# Regression tests of the integer coded SLM counts
+#
+# Run with: python -m pytest slm_t+1
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import slm
+from slm import (
+        OnlineSLM, SLMModel, SparseTable, corpus_hash, entries, load_model, lookup, ngram_codes, ngram_table,
+        quantile_edges, symbolize, updown_probs,
+        )
+
+
+def rescaled(counts, weight):
+    """Return the count tables divided by the weight of the newest counts"""
+    scaled = []
+    for count in counts:
+        if isinstance(count, SparseTable):
+            scaled.append(SparseTable(count.size, ((code, c / weight) for code, c in count.items())))
+        else:
+            scaled.append(count / weight)
+
+    return scaled
+
+
+def online_model(m, order, decay, max_weight=None):
+    rng = np.random.default_rng(2024)
+    model = OnlineSLM.from_model(SLMModel.fit(rng.integers(1, m + 1, 3000), order, m), decay)
+    if max_weight is not None:
+        model.MAX_WEIGHT = max_weight
+
+    for symbol in rng.integers(1, m + 1, 500).tolist():
+        model.update(symbol)
+
+    return model
+
+
+@pytest.mark.parametrize(
+    "m, order, decay, max_weight",
+    [
+        (2, 6, 0.99, None),
+        (2, 6, 0.9, 10.0),  # 权重超过上限后统一缩放
+        (3, 4, 0.95, None),
+        (4, 11, 0.99, None),  # 稀疏的高阶计数
+    ],
+)
+def test_smoothed_decay(m, order, decay, max_weight):
+    model = online_model(m, order, decay, max_weight)
+    assert model.weight != 1.0
+
+    reference = SLMModel(rescaled(model.counts, model.weight), m)
+    codes = np.arange(min(m ** order, 1 << 16))
+    for n in range(1, order + 1):
+        expected = lookup(reference.smoothed(n), codes[codes < m ** n])
+        result = lookup(model.smoothed(n), codes[codes < m ** n])
+        np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-15)
+
+
+def test_smoothed_no_decay():
+    model = online_model(2, 6, 1.0)
+    assert model.weight == 1.0
+
+    reference = SLMModel(model.counts, 2)
+    for n in range(1, 7):
+        np.testing.assert_array_equal(model.smoothed(n), reference.smoothed(n))
+
+
+def get_patterns(df: pd.DataFrame, n: int):
+    """The original string keyed counts of MyStrats.get_patterns, kept as the reference"""
+    pat_list = [df['pat'].iloc[i:i + n].values for i in range(len(df) - n + 1)]
+    pat_list = [np.array2string(pat, separator=',') for pat in pat_list]
+    pat = pd.Series(pat_list).value_counts()
+
+    return pat
+
+
+def decode(key, m):
+    """Return the code of a get_patterns key, e.g. '[2,1,2]' -> 0b101 for m = 2"""
+    code = 0
+    for symbol in key.strip("[]").split(","):
+        code = code * m + int(symbol) - 1
+
+    return code
+
+
+@pytest.mark.parametrize("m", [2, 3])
+def test_ngram_table_get_patterns(m):
+    pats = np.random.default_rng(7).integers(1, m + 1, 40)
+    df = pd.DataFrame({"pat": pats})
+
+    for n in range(1, 7):
+        expected = np.zeros(m ** n)
+        for key, count in get_patterns(df, n).items():
+            expected[decode(key, m)] = count
+
+        # 编码与字符串键的计数一一对应
+        np.testing.assert_array_equal(np.bincount(ngram_codes(pats, n, m), minlength=m ** n), expected)
+        np.testing.assert_allclose(ngram_table(pats, n, m), expected / (len(pats) - n + 1), rtol=1e-15)
+
+
+def dense(table):
+    """Return a count table as an array of all its codes"""
+    if isinstance(table, SparseTable):
+        out = np.zeros(table.size)
+        codes, values = entries(table)
+        out[codes] = values
+        return out
+
+    return np.asarray(table, dtype=np.float64)
+
+
+@pytest.mark.parametrize("m, order", [(2, 10), (3, 6), (4, 11)])
+def test_fit_per_order_counts(m, order):
+    """The orders summed from the highest one equal the counts of each order"""
+    pats = np.random.default_rng(11).integers(1, m + 1, 5000)
+    model = SLMModel.fit(pats, order, m)
+
+    assert model.order == order
+    assert isinstance(model.count(order), SparseTable) == (m ** order > slm.DENSE_SIZE)
+    for k in range(1, order + 1):
+        expected = np.bincount(ngram_codes(pats, k, m), minlength=m ** k)
+        np.testing.assert_array_equal(dense(model.count(k)), expected)
+
+
+def test_load_model_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(slm, "_models", {})
+    pats = np.random.default_rng(3).integers(1, 3, 500)
+
+    model = load_model(pats, 6, 2, folder=str(tmp_path))
+    path = tmp_path / f"{corpus_hash(pats)}_2_6.npz"
+    assert path.exists()
+    assert load_model(pats, 6, 2, folder=str(tmp_path)) is model
+
+    # 从磁盘读取的计数与重新统计的相同
+    monkeypatch.setattr(slm, "_models", {})
+    cached = load_model(pats, 6, 2, folder=str(tmp_path))
+    assert cached is not model
+    for k in range(1, 7):
+        np.testing.assert_array_equal(cached.count(k), model.count(k))
+
+    # 语料库或阶数改变时重新统计并写入新的文件
+    changed = pats.copy()
+    changed[-1] = 3 - changed[-1]
+    other = load_model(changed, 6, 2, folder=str(tmp_path))
+    assert (tmp_path / f"{corpus_hash(changed)}_2_6.npz").exists()
+    np.testing.assert_array_equal(other.count(6), np.bincount(ngram_codes(changed, 6), minlength=64))
+
+    longer = load_model(pats, 8, 2, folder=str(tmp_path))
+    assert (tmp_path / f"{corpus_hash(pats)}_2_8.npz").exists()
+    assert longer.order == 8
+    np.testing.assert_array_equal(longer.count(8), np.bincount(ngram_codes(pats, 8), minlength=256))
+
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+@pytest.mark.parametrize("m, order", [(2, 6), (3, 4), (4, 11)])
+def test_update_matches_fit(m, order):
+    """Counts updated symbol by symbol equal a batch fit of the same window"""
+    pats = np.random.default_rng(5).integers(1, m + 1, 300)
+    model = OnlineSLM([np.zeros(m ** k) for k in range(1, order + 1)], m=m)
+
+    for t, symbol in enumerate(pats.tolist(), 1):
+        model.update(symbol)
+        if t % 25 and t > order + 1:
+            continue
+
+        batch = SLMModel.fit(pats[:t], order, m)
+        for k in range(1, order + 1):
+            np.testing.assert_array_equal(dense(model.count(k)), dense(batch.count(k)))
+            assert model.totals[k - 1] == max(t - k + 1, 0)
+
+        codes = ngram_codes(pats[:t], order, m)
+        if len(codes):
+            assert model.prob(codes[-1], order) == batch.prob(codes[-1], order)
+
+
+def test_update_after_training():
+    """Walk-forward counts add the n-grams of the test window to those of the training corpus"""
+    rng = np.random.default_rng(6)
+    train, test = rng.integers(1, 3, 1000), rng.integers(1, 3, 200)
+    model = OnlineSLM.from_model(SLMModel.fit(train, 8))
+
+    for symbol in test.tolist():
+        model.update(symbol)
+
+    # 训练集与测试期之间的n-gram不计入, 与分别统计的结果相同
+    window = SLMModel.fit(test, 8)
+    trained = SLMModel.fit(train, 8)
+    for k in range(1, 9):
+        np.testing.assert_array_equal(model.count(k), trained.count(k) + window.count(k))
+
+
+@pytest.mark.parametrize("m, order", [(3, 6), (4, 5)])
+def test_sparse_matches_dense(m, order, monkeypatch):
+    """Every order stored as a SparseTable gives the tables of the dense arrays"""
+    pats = np.random.default_rng(9).integers(1, m + 1, 2000)
+    model = SLMModel.fit(pats, order, m)
+
+    monkeypatch.setattr(slm, "DENSE_SIZE", 0)
+    sparse = SLMModel.fit(pats, order, m)
+    assert all(isinstance(count, SparseTable) for count in sparse.counts)
+    assert not any(isinstance(count, SparseTable) for count in model.counts)
+
+    for n in range(1, order + 1):
+        codes = np.arange(m ** n)
+        np.testing.assert_array_equal(lookup(sparse.count(n), codes), model.count(n))
+        np.testing.assert_allclose(lookup(sparse.joint(n), codes), model.joint(n), rtol=1e-12)
+        np.testing.assert_allclose(lookup(sparse.conditional(n), codes), model.conditional(n), rtol=1e-12)
+        np.testing.assert_allclose(lookup(sparse.smoothed(n), codes), model.smoothed(n), rtol=1e-12)
+
+
+def test_symbolize():
+    band = 0.002
+    ret = [-0.01, -band, -0.001, 0.0, band, 0.0021, 0.01, np.nan]
+
+    np.testing.assert_array_equal(symbolize(ret, [0.0]), [1, 1, 1, 1, 2, 2, 2, 2])
+    # 平盘区间 (-band, band]
+    np.testing.assert_array_equal(symbolize(ret, [-band, band]), [1, 1, 2, 2, 2, 3, 3, 3])
+
+    # 等分位数的各符号频率相同
+    rets = np.random.default_rng(4).normal(0, 0.01, 1000)
+    for m in (3, 4, 5):
+        edges = quantile_edges(np.r_[rets, np.nan], m)
+        assert len(edges) == m - 1
+        counts = np.bincount(symbolize(rets, edges), minlength=m + 1)[1:]
+        assert counts.sum() == 1000 and counts.max() - counts.min() <= 1
+
+
+@pytest.mark.parametrize(
+    "probs, expected",
+    [
+        ([0.4, 0.6], (0.6, 0.4)),
+        ([0.3, 0.5, 0.2], (0.2, 0.3)),  # 中间的平盘符号不计入
+        ([0.1, 0.2, 0.3, 0.4], (0.7, 0.3)),
+        ([0.1, 0.1, 0.6, 0.1, 0.1], (0.2, 0.2)),
+    ],
+)
+def test_updown_probs(probs, expected):
+    np.testing.assert_allclose(updown_probs(probs), expected)
@@ -4,14 +4,17 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
+import os, sys
+
+sys.path.append(os.path.abspath(".."))
+from common import datastore
+
 
-datapath = '../data.csv'
-data = pd.read_csv(datapath, index_col='TRADE_DT', parse_dates=True)
 contracts = ['IF00', 'IH00', 'IC00']
 
 df = pd.DataFrame(columns=contracts)
 for c in contracts:
-    contract_df = data[data['S_INFO_CODE'] == c].loc[:, 'S_DQ_CLOSE']
+    contract_df = datastore.load(c, columns=['S_DQ_CLOSE'])['S_DQ_CLOSE']
     df[c] = contract_df
 
 df = df.dropna()
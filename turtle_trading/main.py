@@ -15,6 +15,12 @@ import warnings
 from collections import defaultdict
 from comminfo import IFCommInfo, IHCommInfo, ICCommInfo
 
+sys.path.append(os.path.abspath(".."))
+from common.bars import load_bars
+from common.feeds import ArrayData
+from common.lazy import lazyframe
+from common.lowmem import Lookback, cerebro_kwargs
+
 warnings.filterwarnings("ignore")
 
 
@@ -27,8 +33,6 @@ class Config:
     # 回测区间
     fromdate = datetime.date(2015, 4, 16)
     todate = datetime.date(2021, 12, 31)
-    filepath = os.path.abspath("../data.csv")
-    data = pd.read_csv(filepath, index_col="TRADE_DT", parse_dates=True)
 
     # 交易参数
     stamp_duty = 0.001
@@ -37,43 +41,35 @@ class Config:
     margin = 0.12
     startcash = 10_000_000 * 3
 
-    def __init__(self):
-        # 数据处理
-        self.if00 = self.create_df(self.data, self.valid_contracts[0], 'daily')
-        self.ih00 = self.create_df(self.data, self.valid_contracts[1], 'daily')
-        self.ic00 = self.create_df(self.data, self.valid_contracts[2], 'daily')
-        self.first_days = self.get_firstday(self.if00)  # keep records for the first day of the year
+    # lazyframe 的缓存键: 各帧所依赖的属性
+    memo_attrs = ('valid_contracts', 'fromdate', 'todate')
 
-    def create_df(self, data, contract, freq):
-        """
-        Convert the raw .csv file into the target
-        dataframe with specified frequency
-        """
-        df = data[data["S_INFO_CODE"] == contract]
-        df.index = pd.to_datetime(df.index)
-
-        adj_cols = [
-            "S_DQ_ADJOPEN",
-            "S_DQ_ADJHIGH",
-            "S_DQ_ADJLOW",
-            "S_DQ_ADJCLOSE",
-        ]
-        pre_cols = ["S_DQ_OPEN", "S_DQ_HIGH", "S_DQ_LOW", "S_DQ_CLOSE"]
+    # 数据处理
+    @lazyframe
+    def if00(self):
+        return self.create_df(self.valid_contracts[0], 'daily')
 
-        for pre_col, adj_col in zip(pre_cols, adj_cols):
-            df.loc[:, adj_col] = round(df.loc[:, pre_col] * df.loc[:, "S_DQ_ADJFACTOR"], 1)
+    @lazyframe
+    def ih00(self):
+        return self.create_df(self.valid_contracts[1], 'daily')
 
-        df = df[adj_cols]
+    @lazyframe
+    def ic00(self):
+        return self.create_df(self.valid_contracts[2], 'daily')
 
-        methods = ["first", "max", "min", "last"]
-        agg_dict = {col: method for col, method in zip(adj_cols, methods)}
+    @lazyframe
+    def first_days(self):
+        # keep records for the first day of the year
+        return self.get_firstday(self.if00)
 
-        if freq == "weekly":
-            df = df.resample("W-MON").agg(agg_dict).dropna()
-        elif freq == "daily":
-            df = df.resample("D").agg(agg_dict).dropna()
+    def create_df(self, contract, freq):
+        """
+        Return the adjusted bars of the contract with specified
+        frequency, resampled once and then read from the bar cache
+        """
+        rules = {"weekly": "W-MON", "daily": "D"}
 
-        return df
+        return load_bars(contract, rules[freq], self.fromdate, self.todate)
 
     def set_margin(self):
         # 保证金设置
@@ -127,7 +123,7 @@ class Logger:
         pass
 
 
-class DataInput(bt.feeds.PandasData):
+class DataInput(ArrayData):
     params = (
         ("nullvalue", np.nan),
         ("fromdate", metavar.fromdate),
@@ -193,7 +189,7 @@ class TurtleSizer(bt.Sizer):
         return atr_size
 
 
-class Turtle(bt.Strategy):
+class Turtle(Lookback, bt.Strategy):
     """Turtle trading system"""
 
     params = (
@@ -452,6 +448,10 @@ class Turtle(bt.Strategy):
 
         return uptrend or downtrend
     
+    def lookback(self):
+        # is_trend 读取前一个bar的最高价
+        return 2
+
     def is_limit(self, data):
         """Check if the limited conditions are satisfied"""
         limit_conds =[
@@ -461,11 +461,17 @@ class Turtle(bt.Strategy):
 
         return any(limit_conds)
 
-def run():
-    sys.stdout = Logger()
+def build_cerebro(lowmem=False):
+    """
+    Set up the backtest
 
+    lowmem=True bounds the line buffers of the sub-indicators
+    (exactbars=-1 for the three datas, see common/lowmem.py),
+    `check_lowmem(build_cerebro)` verifies that it trades exactly like
+    the full run
+    """
     # initialisation
-    cerebro = bt.Cerebro()
+    cerebro = bt.Cerebro(**cerebro_kwargs(lowmem, datas=3))
     cerebro.addstrategy(Turtle)
 
     # Add datafeeds and comminfos
@@ -486,6 +492,14 @@ def run():
     cerebro.addanalyzer(bt.analyzers.TimeReturn, _name="_TimeReturn")
     cerebro.addanalyzer(bt.analyzers.PyFolio, _name="pyfolio")
 
+    return cerebro
+
+
+def run(lowmem=False):
+    sys.stdout = Logger()
+
+    cerebro = build_cerebro(lowmem)
+
     # Backtesting
     print(f"开始资金总额 {cerebro.broker.getvalue():.2f}")
     results = cerebro.run()